@@ -0,0 +1,179 @@
+# *************************************************************************************
+
+# MODULE NAME: cache.py
+
+# SYS-REQ: PDFC-SYS-XXX
+
+# SW-REQ: PDFC-SRS-XXX
+
+# MODULE DESCRIPTION: This module provides the persistent, content addressed caches
+#                     shared by the conversion/comparison sessions and their workers.
+#                     Entries are evicted least recently used first above a size limit.
+
+# REVISION HISTORY:
+#   $Id$
+#   PCR# N/A
+#   Initial Development
+
+# *************************************************************************************
+
+
+from pdfcu.pdfc import Task, Folder
+from contextlib import contextmanager
+import hashlib
+import shutil
+import json
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+class FileCache(Task):
+
+    # Total size of the entries, shared by all the caches (sessions/workers) on the directory. It is kept under a
+    # file lock but the size limit is approximate: files removed behind its back are only accounted at the next
+    # eviction (directory scan).
+    SIZE_FILE = '_size'
+
+    def __init__(self, cache_dir, max_bytes=10 * 1024 ** 3):
+
+        super(FileCache, self).__init__(cache_dir)
+
+        self.path = Folder(cache_dir).path
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(*fields):
+        # Content address of an entry: digest of all the fields it depends on
+        return hashlib.sha1('|'.join(str(f) for f in fields).encode('utf-8')).hexdigest()
+
+    def entry_path(self, key, ext=''):
+        return os.path.join(self.path, key[:2], key + ext)
+
+    def fetch(self, key, ext, output):
+        # Copy a cached entry to output, refreshing its LRU time stamp
+        entry = self.entry_path(key, ext)
+        try:
+            shutil.copyfile(entry, output)
+            os.utime(entry)
+        except FileNotFoundError:
+            return False
+
+        return True
+
+    def store(self, key, ext, source):
+        entry = self.entry_path(key, ext)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+
+        # Write beside the entry then swap it in, concurrent readers never see a partial file
+        tmp = '{}.{}.tmp'.format(entry, os.getpid())
+        shutil.copyfile(source, tmp)
+        self.commit(tmp, entry)
+
+    def commit(self, tmp, entry):
+        with self.locked_size() as f:
+            # an entry written again (e.g. by another worker) only adds its size difference
+            try:
+                old = os.path.getsize(entry)
+            except FileNotFoundError:
+                old = 0
+
+            os.replace(tmp, entry)
+
+            # the directory is scanned only for a cache without size file yet, or to evict entries
+            f.seek(0)
+            text = f.read().strip()
+            size = int(text) + os.path.getsize(entry) - old if text else self.evict()
+
+            if size > self.max_bytes:
+                size = self.evict()
+
+            f.seek(0)
+            f.truncate()
+            f.write(str(size))
+
+    @contextmanager
+    def locked_size(self):
+        # Size file opened under an exclusive lock, one cache on the directory updates it at a time
+        with open(os.path.join(self.path, self.SIZE_FILE), 'a+') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+            try:
+                yield f
+            finally:
+                f.flush()
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def evict(self):
+        # Remove the least recently used entries until the cache fits its size limit, returns the size left.
+        # Called with the size file locked (see commit).
+        entries = []
+        for sub in os.scandir(self.path):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+
+        size = sum(e[1] for e in entries)
+
+        for mtime, nbytes, path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= nbytes
+
+        return size
+
+
+class PageCache(FileCache):
+
+    def page_key(self, pdf_hash, page, res, img_ext, background, alpha):
+        return self.make_key('page', pdf_hash, page, res, img_ext.lower(), background, alpha)
+
+
+class ResultCache(FileCache):
+
+    def result_key(self, hash_a, hash_b, params: dict):
+        return self.make_key('ssim', hash_a, hash_b, json.dumps(params, sort_keys=True, default=str))
+
+    def get(self, key):
+        # Stored comparison record, refreshing its LRU time stamp
+        entry = self.entry_path(key, '.json')
+        try:
+            with open(entry, 'r') as f:
+                record = json.load(f)
+            os.utime(entry)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        return record
+
+    def put(self, key, record: dict):
+        entry = self.entry_path(key, '.json')
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+
+        tmp = '{}.{}.tmp'.format(entry, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(record, f, default=str)
+        self.commit(tmp, entry)
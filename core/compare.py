@@ -19,17 +19,23 @@
 # *************************************************************************************
 
 
-from pdfcu.pdfc import ImageFile, Task, Folder, Timer
-from pdfcu.generate import GenerateCompareTask
+from pdfcu.pdfc import File, ImageFile, PdfFile, Task, Folder, Timer
+from pdfcu.generate import GenerateCompareTask, GenerateConvertTask, ArtifactWriter
 from pdfcu.report import ImageComparisonReporter
-from pdfcu.util.ssim import compare_ssim
-from numpy import zeros
+from pdfcu.records import ComparisonRecord
+from pdfcu.util.ssim import compare_ssim, compare_ssim_tiled, compare_ssim_pyramid, compare_ssim_batch, ssim_batch_size
+from pdfcu.util.regions import merge_boxes, region_scores
+from numpy import array, array_equal, stack
+from concurrent.futures import ProcessPoolExecutor
+from itertools import zip_longest
 import cv2
 import os
 
 
 class ImageCompareTask(Task):
-    def __init__(self, session_folder, report=False, typ='manual'):
+    def __init__(self, session_folder, report=False, typ='manual', ssim_args=None,
+                 tile_pixels=50000000, tile_rows=1024, tile_memmap=False, mode='full', pyramid_args=None,
+                 result_cache=None, backend='csv', writer=None, mark_crops=False, region_gap=16):
 
         super(ImageCompareTask, self).__init__(session_folder)
 
@@ -41,48 +47,161 @@ class ImageCompareTask(Task):
         self.name = None
         self.file_a = None
         self.file_b = None
-        self.alpha_a = None
-        self.alpha_b = None
+        self.gray_a = None
+        self.gray_b = None
         self.score = None
         self.diff = None
         self.thres = None
-        self.marks = None
-        self.generator = GenerateCompareTask(session_folder)
+        self.page_size = None
+        self.generator = GenerateCompareTask(session_folder, writer)
         self.isreporting = report
+        self.backend = backend
         self.isvalid = False
+        self.fastpath = None
         self.time = None
         self.date = None
         self.type = typ
 
+        # extra compare_ssim options (e.g. engine='integral', dtype=float32)
+        self.ssim_args = dict(ssim_args) if ssim_args else {}
+
+        # pages above this pixel count are compared strip by strip
+        self.tile_pixels = tile_pixels
+        self.tile_rows = tile_rows
+        self.tile_memmap = tile_memmap
+
+        # memory-mapped SSIM map file of a tiled comparison, removed once the artifacts are made
+        self.ssim_memmap = None
+
+        # 'pyramid': coarse-to-fine SSIM, only the regions of interest at full resolution (roi_blocks, (y0, y1, x0, x1))
+        self.mode = mode
+        self.pyramid_args = dict(pyramid_args) if pyramid_args else {}
+        self.roi_blocks = None
+
+        # diff/thres image paths once generated (or restored from the result cache)
+        self.artifacts = None
+
+        # marks are kept as a list of bounding boxes (x, y, w, h), overlays are rendered on demand (render_marks)
+        self.marks = None
+        self.mark_crops = mark_crops
+        self.crops = None
+
+        # difference regions: nearby marks merged (at most region_gap pixels apart) and scored from the SSIM map,
+        # most different first [{'x', 'y', 'w', 'h', 'score', 'marks'}, ...]
+        self.region_gap = region_gap
+        self.diff_regions = None
+
+        # persistent SSIM result cache (see cache.ResultCache), looked up once per pair
+        self.result_cache = result_cache
+        self.cache_key = None
+        self.cached = None
+
+        # (score, S) already computed with other pairs of the same size, see compare_page_batch
+        self.ssim_result = None
+
+    def files_comparable(self):
+        return (self.file_a is not None and self.file_b is not None) and \
+               (self.file_a.orientation == self.file_b.orientation) and \
+               (self.file_a.size == self.file_b.size)
+
+    def identical_files(self):
+        return os.path.getsize(self.file_a.path) == os.path.getsize(self.file_b.path) and \
+               self.file_a.content_hash() == self.file_b.content_hash()
+
+    def ssim_pending(self):
+        # Page shape (height, width) if compare_images would compute a plain full SSIM of the two files, else None.
+        # Taken from the image headers, nothing is decoded (see compare_page_batch).
+        if self.mode != 'full' or self.ssim_args.get('engine', 'filter') != 'filter':
+            return None
+
+        if self.cached or not self.files_comparable() or self.identical_files():
+            return None
+
+        width, height = self.file_a.size
+
+        if self.tile_pixels is not None and width * height > self.tile_pixels:
+            return None
+
+        return height, width
+
     def validate_files(self):
 
-        if (self.file_a is not None and self.file_b is not None) and \
-           (self.file_a.orientation == self.file_b.orientation) and \
-           (self.file_a.size == self.file_b.size):
+        if self.file_a is None and self.file_b is None and self.gray_a is not None and self.gray_b is not None:
+            # In-memory pages (see PdfCompareTask) are comparable when they have the same size
+            self.isvalid = self.gray_a.shape == self.gray_b.shape
 
-            self.isvalid = True
+            if self.isvalid:
+                self.compare_arrays()
 
-            # Read images as OpenCV
-            cv_file_a = cv2.imread(self.file_a.path)
-            cv_file_b = cv2.imread(self.file_b.path)
+        elif self.files_comparable():
+
+            self.isvalid = True
 
-            # Generate alpha image for the markers
-            aH, aW = cv_file_a.shape[:2]
-            bH, bW = cv_file_b.shape[:2]
-            self.alpha_a = zeros((aH, aW, 4), dtype='uint8')
-            self.alpha_b = zeros((bH, bW, 4), dtype='uint8')
+            # Identical files need no decoding at all
+            if self.identical_files():
+                self.set_identical('hash')
+                return
 
-            # Convert to grayscale
-            gray_file_a = cv2.cvtColor(cv_file_a, cv2.COLOR_BGR2GRAY)
-            gray_file_b = cv2.cvtColor(cv_file_b, cv2.COLOR_BGR2GRAY)
+            # Decode each image once, straight to grayscale (shared by the checks below and the SSIM)
+            self.decode_images()
 
-            # Compute SSIM between two grayscale images
-            (self.score, self.diff) = compare_ssim(gray_file_a, gray_file_b, full=True)
+            self.compare_arrays()
 
         else:
             self.isvalid = False
 
-        self.name = self.file_a.filename.rsplit('.', 1)[0] + '_vs_' + self.file_b.filename.rsplit('.', 1)[0]
+    def compare_arrays(self):
+
+        height, width = self.gray_a.shape[:2]
+        self.page_size = (width, height)
+
+        # Pixel-identical images (e.g. re-encoded) skip the SSIM too (already checked for a batch result)
+        if self.ssim_result is None and array_equal(self.gray_a, self.gray_b):
+            self.set_identical('pixels')
+            return
+
+        # Compute SSIM between two grayscale images
+        (self.score, self.diff) = self.compute_ssim(self.gray_a, self.gray_b)
+
+    def decode_images(self):
+        # Arrays already decoded (or handed over by the caller) are not read again
+        if self.gray_a is None:
+            self.gray_a = cv2.imread(self.file_a.path, cv2.IMREAD_GRAYSCALE)
+        if self.gray_b is None:
+            self.gray_b = cv2.imread(self.file_b.path, cv2.IMREAD_GRAYSCALE)
+
+    def set_identical(self, fastpath):
+        # Short-circuit: full similarity, no diff/thres/marks generated
+        self.fastpath = fastpath
+        self.score = 1.0
+        self.diff = None
+
+    def compute_ssim(self, gray_a, gray_b):
+
+        if self.ssim_result is not None:
+            return self.ssim_result
+
+        if self.mode == 'pyramid':
+            args = dict(self.ssim_args)
+            args.update(self.pyramid_args)
+            score, diff, self.roi_blocks = compare_ssim_pyramid(gray_a, gray_b, full=True, **args)
+            return score, diff
+
+        # Huge pages (e.g. large format drawings) are processed in strips to bound memory
+        if self.tile_pixels is not None and gray_a.size > self.tile_pixels:
+            if self.tile_memmap:
+                self.ssim_memmap = os.path.join(self.folder.add_subfolder('ssim'), self.name + '.npy')
+
+            return compare_ssim_tiled(gray_a, gray_b, full=True, strip_height=self.tile_rows,
+                                      memmap=self.ssim_memmap, **self.ssim_args)
+
+        return compare_ssim(gray_a, gray_b, full=True, **self.ssim_args)
+
+    def remove_ssim_memmap(self):
+        # Delete the SSIM map file of a tiled comparison (once no array maps it anymore)
+        if self.ssim_memmap is not None and os.path.isfile(self.ssim_memmap):
+            os.remove(self.ssim_memmap)
+        self.ssim_memmap = None
 
     def set_session_path(self, subfolder: [str], img_form='JPG'):
 
@@ -111,10 +230,98 @@ class ImageCompareTask(Task):
 
         return [mrk_img_a, mrk_img_b]
 
+    def artifact_paths(self):
+        return {'diff': self.diffpath(), 'thres': self.threspath()}
+
+    def index_regions(self, ssim_map):
+        # Merge the marks into regions and score each one with the mean SSIM over it
+        regions = merge_boxes(self.marks, gap=self.region_gap)
+        scores = region_scores(ssim_map, regions) if regions else []
+
+        mx, my, mw, mh = array(self.marks, dtype='int64').reshape(-1, 4).T
+
+        diff_regions = []
+        for (x, y, w, h), score in zip(regions, scores):
+            # number of marks merged into the region
+            count = int(((x <= mx) & (y <= my) & (mx + mw <= x + w) & (my + mh <= y + h)).sum())
+            diff_regions.append({'x': x, 'y': y, 'w': w, 'h': h, 'score': float(score), 'marks': count})
+
+        # most severe (lowest similarity) first
+        return sorted(diff_regions, key=lambda r: r['score'])
+
+    def region_boxes(self):
+        if self.diff_regions is not None:
+            return [(r['x'], r['y'], r['w'], r['h']) for r in self.diff_regions]
+        return self.marks
+
+    def render_marks(self):
+        # Full size marks overlays (marks_a/marks_b) of a compared pair, on demand (one box per region)
+        if not self.marks:
+            return None
+
+        paths = self.generator.render_marks(self.region_boxes(), self.page_size, self.markspath())
+        self.artifacts = dict(self.artifacts or {}, marks_a=paths[0], marks_b=paths[1])
+
+        return paths
+
+    def result_key(self):
+        # Everything the result (SSIM, regions, crops) depends on besides the two image contents
+        params = {'win_size': None, 'gaussian_weights': False, 'K1': 0.01, 'K2': 0.03,
+                  'sigma': 1.5, 'data_range': None, 'mode': self.mode, 'decode': 'grayscale',
+                  'region_gap': self.region_gap, 'mark_crops': self.mark_crops}
+        params.update(self.ssim_args)
+        if self.mode == 'pyramid':
+            params.update(('pyramid_' + k, v) for k, v in self.pyramid_args.items())
+
+        return self.result_cache.result_key(self.file_a.content_hash(), self.file_b.content_hash(), params)
+
+    def lookup_result(self):
+        # Look for the result of the same comparison (same image contents and parameters)
+        self.cache_key = self.result_key()
+        record = self.result_cache.get(self.cache_key)
+        self.cached = record is not None and self.restore_result(record)
+
+        return self.cached
+
+    def restore_result(self, record):
+        # A cached result is only usable if its artifact images are still there
+        artifacts = record['artifacts']
+        if artifacts is not None and not all(os.path.isfile(p) for p in artifacts.values()):
+            return False
+
+        self.isvalid = record['valid']
+        self.score = record['score']
+        self.fastpath = record['fastpath']
+        self.roi_blocks = record.get('roi_blocks')
+        self.artifacts = artifacts
+        self.diff_regions = record.get('diff_regions')
+        self.crops = record.get('crops')
+
+        # tuples as when computed (JSON keeps lists)
+        marks, page_size = record.get('marks'), record.get('page_size')
+        self.marks = None if marks is None else [tuple(m) for m in marks]
+        self.page_size = None if page_size is None else tuple(page_size)
+
+        return True
+
     def read_images(self, file_a, file_b):
 
-        self.file_a = ImageFile(file_a)
-        self.file_b = ImageFile(file_b)
+        # With a result cache the files are only hashed first, a cached comparison opens no image at all
+        if self.result_cache is not None:
+            self.file_a = File(file_a)
+            self.file_b = File(file_b)
+
+            # missing files are not cached (invalid comparison)
+            self.cached = self.file_a.exists and self.file_b.exists and self.lookup_result()
+
+        if not self.cached:
+            digests = (self.file_a.digest, self.file_b.digest) if self.file_a is not None else (None, None)
+
+            self.file_a = ImageFile(file_a)
+            self.file_b = ImageFile(file_b)
+            self.file_a.digest, self.file_b.digest = digests
+
+        self.name = self.file_a.filename.rsplit('.', 1)[0] + '_vs_' + self.file_b.filename.rsplit('.', 1)[0]
 
         self.source_a = self.file_a.filename.split('__pg_')[0]
         self.source_b = self.file_b.filename.split('__pg_')[0]
@@ -122,35 +329,388 @@ class ImageCompareTask(Task):
         self.source_a_pg = int(self.file_a.filename.split('__pg_')[1].split('.')[0])
         self.source_b_pg = int(self.file_b.filename.split('__pg_')[1].split('.')[0])
 
+    def load_arrays(self, source_a, page_a, gray_a, source_b, page_b, gray_b):
+        # Compare grayscale page arrays already in memory (no image files to read)
+        self.source_a, self.source_a_pg, self.gray_a = source_a, page_a, gray_a
+        self.source_b, self.source_b_pg, self.gray_b = source_b, page_b, gray_b
+
+        self.name = GenerateConvertTask.assemble_genfilename(source_a, page_a, '') + '_vs_' + \
+            GenerateConvertTask.assemble_genfilename(source_b, page_b, '')
+
+    def labels(self):
+        if self.file_a is not None and self.file_b is not None:
+            return self.file_a.filename, self.file_b.filename
+
+        return '{}[{}]'.format(self.source_a, self.source_a_pg), '{}[{}]'.format(self.source_b, self.source_b_pg)
+
     def compare_images(self):
 
         timer = Timer()
 
         timer.start_timer()
 
-        # validate images
-        self.validate_files()
+        # look for the result of the same comparison, unless read_images already did
+        if self.result_cache is not None and self.cached is None and self.file_a is not None:
+            self.lookup_result()
+
+        if not self.cached:
 
-        if self.isvalid:
+            # validate images
+            self.validate_files()
 
-            # DIFFERENCE
-            self.diff = self.generator.generate_diff(self.diff, self.diffpath())
+            if self.isvalid and self.fastpath is None:
 
-            # THRESHOLD
-            self.thres = self.generator.generate_thres(self.diff, self.threspath())
+                self.artifacts = self.artifact_paths()
+                ssim_map = self.diff
 
-            # MARKINGS
-            self.marks = self.generator.generate_marks(self.thres, self.alpha_a, self.alpha_b, self.markspath())
+                # DIFFERENCE (converted strip by strip, the SSIM map may be a huge memory-mapped file)
+                self.diff = self.generator.generate_diff(self.diff, self.artifacts['diff'], self.tile_rows)
 
-        print('Comparing: {} vs {} :: ssim: {:.3f} %\n'.format(self.file_a.filename,
-                                                               self.file_b.filename,
-                                                               'INVALID' if self.score is None else self.score * 100.0))
+                # THRESHOLD
+                self.thres = self.generator.generate_thres(self.diff, self.artifacts['thres'], self.roi_blocks)
+
+                # MARKINGS (bounding boxes only)
+                self.marks = self.generator.generate_marks(self.thres)
+
+                # REGIONS (optionally with the crops of both pages)
+                self.diff_regions = self.index_regions(ssim_map)
+
+                if self.mark_crops:
+                    self.crops = self.generator.generate_crops(self.region_boxes(), self.gray_a, self.gray_b,
+                                                               os.path.join(self.folder.add_subfolder('crops'),
+                                                                            self.name))
+
+                # the SSIM map is not needed anymore
+                del ssim_map
+                self.remove_ssim_memmap()
+
+        label_a, label_b = self.labels()
+
+        score = 'INVALID' if self.score is None else '{:.3f} %'.format(self.score * 100.0)
+        identical = '' if self.fastpath is None else ' (identical: {})'.format(self.fastpath)
+
+        print('Comparing: {} vs {} :: ssim: {}{}\n'.format(label_a, label_b, score, identical))
 
         timer.stop_timer()
 
         self.time = timer.get_elapsed()
         self.date = timer.get_date_time()
 
+        # store the new result
+        if self.cache_key is not None and not self.cached:
+            self.result_cache.put(self.cache_key, {'valid': self.isvalid,
+                                                   'score': self.score,
+                                                   'fastpath': self.fastpath,
+                                                   'roi_blocks': self.roi_blocks,
+                                                   'artifacts': self.artifacts,
+                                                   'marks': self.marks,
+                                                   'diff_regions': self.diff_regions,
+                                                   'crops': self.crops,
+                                                   'page_size': self.page_size})
+
         if self.isreporting:
-            reporter = ImageComparisonReporter(self.folder.path, self)
+            reporter = ImageComparisonReporter(self.folder.path, self, self.backend)
             reporter.create_report()
+
+
+def compare_page_pair(session_folder, file_a, file_b, typ='batch', ssim_args=None, result_cache=None,
+                      writer_threads=2, max_pending=8):
+    # Worker process: compare one page pair and return its record (the task itself is dropped).
+    # The artifacts are written by the worker's own writer stage while the comparison goes on.
+    with ArtifactWriter(writer_threads, max_pending) as writer:
+        task = ImageCompareTask(session_folder, report=False, typ=typ, ssim_args=ssim_args,
+                                result_cache=result_cache, writer=writer)
+        task.read_images(file_a, file_b)
+        task.compare_images()
+
+    return ComparisonRecord.from_task(task)
+
+
+def compare_page_batch(session_folder, pairs, typ='batch', ssim_args=None, result_cache=None, memory=8 << 20,
+                       writer_threads=2, max_pending=8):
+    # Worker process: compare a chunk of page pairs, the same size pages needing an SSIM are compared in stacks.
+    # Only the image headers are read up front, the pages are decoded one stack at a time.
+    # The chunk's artifacts are written by its own writer stage.
+    with ArtifactWriter(writer_threads, max_pending) as writer:
+        return _compare_page_batch(session_folder, pairs, typ, ssim_args, result_cache, memory, writer)
+
+
+def _compare_page_batch(session_folder, pairs, typ, ssim_args, result_cache, memory, writer):
+
+    # the stacked SSIM takes the plain compare_ssim options only
+    args = {k: v for k, v in (ssim_args or {}).items() if k not in ('engine', 'reuse_buffers')}
+    dtype = args.get('dtype', 'float64')
+
+    records = [None] * len(pairs)
+    groups = {}
+
+    for i, (file_a, file_b) in enumerate(pairs):
+        task = ImageCompareTask(session_folder, report=False, typ=typ, ssim_args=ssim_args,
+                                result_cache=result_cache, writer=writer)
+        task.read_images(file_a, file_b)
+
+        shape = task.ssim_pending()
+
+        if shape is not None and ssim_batch_size(shape, dtype, memory) > 1:
+            groups.setdefault(shape, []).append((i, task))
+        else:
+            # cached, invalid, identical, special (tiled/pyramid) or too large to stack: compared on their own
+            task.compare_images()
+            records[i] = ComparisonRecord.from_task(task)
+
+    for shape in list(groups):
+        members = groups.pop(shape)
+        size = ssim_batch_size(shape, dtype, memory)
+
+        while members:
+            # the decoded pages of a single stack in memory at a time
+            chunk, members = members[:size], members[size:]
+
+            stacked = []
+            for i, task in chunk:
+                task.decode_images()
+
+                # pixel-identical pages (or decoded to another size than their header) are compared on their own
+                if task.gray_a.shape == shape == task.gray_b.shape and not array_equal(task.gray_a, task.gray_b):
+                    stacked.append((i, task))
+                else:
+                    task.compare_images()
+                    records[i] = ComparisonRecord.from_task(task)
+
+            if stacked:
+                scores, maps = compare_ssim_batch(stack([task.gray_a for _, task in stacked]),
+                                                  stack([task.gray_b for _, task in stacked]), full=True, **args)
+
+                for k, (i, task) in enumerate(stacked):
+                    task.ssim_result = (scores[k], maps[k])
+                    task.compare_images()
+                    records[i] = ComparisonRecord.from_task(task)
+
+    return records
+
+
+class FolderCompareTask(Task):
+    def __init__(self, session_folder, folder_a, folder_b, report=False, typ='batch', workers=None, ssim_args=None,
+                 result_cache=None, backend='csv', batch_pairs=None, batch_memory=8 << 20, writer_threads=2,
+                 max_pending=8):
+
+        super(FolderCompareTask, self).__init__(folder_a, folder_b)
+
+        # the input folders must exist (Folder would create them empty)
+        for folder in (folder_a, folder_b):
+            if not os.path.isdir(folder):
+                raise FileNotFoundError('Folder not found: {}'.format(folder))
+
+        self.folder = Folder(session_folder)
+        self.folder_a = Folder(folder_a)
+        self.folder_b = Folder(folder_b)
+        self.pairs = []
+        self.unmatched = []
+        self.results = []
+        self.isreporting = report
+        self.backend = backend
+        self.type = typ
+        self.workers = workers
+        self.ssim_args = ssim_args
+        self.result_cache = result_cache
+        self.time = None
+        self.date = None
+
+        # pairs handed to a worker at once, their same size pages are compared in stacks of at most batch_memory bytes.
+        # Stacking only pays off for small pages (thumbnails, low resolution renders): with the default budget an A4
+        # page at 320 dpi does not fit twice and is compared on its own.
+        self.batch_pairs = batch_pairs
+        self.batch_memory = batch_memory
+
+        # artifact writer stage of each worker (see ArtifactWriter)
+        self.writer_threads = writer_threads
+        self.max_pending = max_pending
+
+    @staticmethod
+    def scan_pages(folder):
+        # Index the converted images of a folder by source and page number (source__pg_NN.ext)
+        pages = {}
+        for entry in sorted(os.listdir(folder)):
+            if '__pg_' not in entry:
+                continue
+
+            source, pg = entry.split('__pg_', 1)
+            try:
+                pg = int(pg.split('.')[0])
+            except ValueError:
+                continue
+
+            pages[(source, pg)] = os.path.join(folder, entry)
+
+        return pages
+
+    def pair_pages(self):
+        pages_a = self.scan_pages(self.folder_a.path)
+        pages_b = self.scan_pages(self.folder_b.path)
+
+        # A single PDF on each side (e.g. v1/manual vs v2/manual_rev2) pairs by page number, whatever the names,
+        # several PDFs pair by source and page number
+        if len({source for source, _ in pages_a}) <= 1 and len({source for source, _ in pages_b}) <= 1:
+            keys_a = {key[1]: key for key in pages_a}
+            keys_b = {key[1]: key for key in pages_b}
+        else:
+            keys_a = {key: key for key in pages_a}
+            keys_b = {key: key for key in pages_b}
+
+        self.pairs = [(pages_a[keys_a[k]], pages_b[keys_b[k]]) for k in sorted(keys_a) if k in keys_b]
+
+        # The pages found in one folder only are reported as invalid
+        self.unmatched = [('a', keys_a[k], pages_a[keys_a[k]]) for k in sorted(keys_a) if k not in keys_b] + \
+                         [('b', keys_b[k], pages_b[keys_b[k]]) for k in sorted(keys_b) if k not in keys_a]
+
+        return self.pairs
+
+    def compare_folders(self):
+
+        timer = Timer()
+
+        timer.start_timer()
+
+        if not self.pairs:
+            self.pair_pages()
+
+        # Dispatch the SSIM work to the pool, results come back in page order
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            if self.batch_pairs:
+                chunks = [self.pairs[i:i + self.batch_pairs] for i in range(0, len(self.pairs), self.batch_pairs)]
+                futures = [pool.submit(compare_page_batch, self.folder.path, chunk, self.type, self.ssim_args,
+                                       self.result_cache, self.batch_memory, self.writer_threads, self.max_pending)
+                           for chunk in chunks]
+                self.results = [record for future in futures for record in future.result()]
+            else:
+                futures = [pool.submit(compare_page_pair, self.folder.path, a, b, self.type, self.ssim_args,
+                                       self.result_cache, self.writer_threads, self.max_pending)
+                           for a, b in self.pairs]
+                self.results = [future.result() for future in futures]
+
+        timer.stop_timer()
+
+        self.time = timer.get_elapsed()
+        self.date = timer.get_date_time()
+
+        print('Compared {} page pairs in {:.3f}s'.format(len(self.results), self.time))
+
+        if self.result_cache is not None and self.results:
+            hits = sum(1 for record in self.results if record.cached)
+            print('Result cache: {} hits / {} pairs ({:.1f} %)'.format(hits, len(self.results),
+                                                                       100.0 * hits / len(self.results)))
+
+        for side, (source, pg), path in self.unmatched:
+            print('No page to compare with: {}'.format(os.path.basename(path)))
+            self.results.append(ComparisonRecord.unmatched(side, source, pg, self.type, self.date, path))
+
+        print('')
+
+        # Write all the results in one go
+        if self.isreporting:
+            reporter = ImageComparisonReporter(self.folder.path, backend=self.backend)
+            reporter.create_batch_report(self.results)
+
+        return self.results
+
+
+class PdfCompareTask(Task):
+    def __init__(self, session_folder, pdf_a, pdf_b, report=False, typ='pdf', res=320, ssim_args=None,
+                 keep_images=False, img_form='JPG', backend='csv', writer_threads=2, max_pending=8, window=1):
+
+        super(PdfCompareTask, self).__init__(pdf_a, pdf_b)
+
+        self.folder = Folder(session_folder)
+        self.pdf_a = PdfFile(pdf_a)
+        self.pdf_b = PdfFile(pdf_b)
+        self.results = []
+        self.isreporting = report
+        self.backend = backend
+        self.type = typ
+        self.resolution = res
+        self.ssim_args = ssim_args
+
+        # pages of each PDF rasterized per read (see PdfFile.stream_pdf)
+        self.window = window
+
+        # write the page images of every page, by default only the pages that differ are written
+        self.keep_images = keep_images
+        self.img_form = img_form
+
+        # images are written by a background stage while the next pages are compared
+        self.writer_threads = writer_threads
+        self.max_pending = max_pending
+        self.writer = None
+
+        self.time = None
+        self.date = None
+
+    def write_page(self, side, source, page, gray):
+        # Page image of a pair worth keeping (same name as a converted page), one folder per side as both PDFs may
+        # have the same name
+        ext = '.png' if self.img_form == 'PNG' else '.jpg'
+        out_folder = self.folder.add_subfolders(['pages', side])
+        output = os.path.join(out_folder, GenerateConvertTask.assemble_genfilename(source, page, ext))
+
+        # queued to the writer stage, the file may not exist yet
+        self.writer.write(output, gray)
+
+        return output
+
+    def compare_pdfs(self):
+
+        timer = Timer()
+
+        timer.start_timer()
+
+        source_a = self.pdf_a.filename.rsplit('.', 1)[0]
+        source_b = self.pdf_b.filename.rsplit('.', 1)[0]
+
+        # Rasterize both PDFs in lockstep, a window of pages of each in memory at a time
+        pages_a = self.pdf_a.stream_pdf(self.resolution, self.window)
+        pages_b = self.pdf_b.stream_pdf(self.resolution, self.window)
+
+        with ArtifactWriter(self.writer_threads, self.max_pending) as self.writer:
+
+            for (pg_a, page_a), (pg_b, page_b) in zip_longest(pages_a, pages_b, fillvalue=(None, None)):
+
+                # extra pages of the longer PDF: invalid, written for review
+                if page_a is None or page_b is None:
+                    side, source, pg, page = ('b', source_b, pg_b, page_b) if page_a is None else \
+                        ('a', source_a, pg_a, page_a)
+
+                    print('No page to compare with: {}[{}]\n'.format(source, pg))
+                    self.results.append(ComparisonRecord.unmatched(
+                        side, source, pg, self.type, timer.get_date_time(),
+                        self.write_page(side, source, pg, GenerateConvertTask.page_array(page))))
+                    continue
+
+                task = ImageCompareTask(self.folder.path, report=False, typ=self.type, ssim_args=self.ssim_args,
+                                        writer=self.writer)
+                task.load_arrays(source_a, pg_a, GenerateConvertTask.page_array(page_a),
+                                 source_b, pg_b, GenerateConvertTask.page_array(page_b))
+                task.compare_images()
+
+                record = ComparisonRecord.from_task(task)
+
+                # Only the pages that differ (or all of them if asked) go to disk
+                if self.keep_images or task.fastpath is None:
+                    record = record._replace(image_a_path=self.write_page('a', source_a, pg_a, task.gray_a),
+                                             image_b_path=self.write_page('b', source_b, pg_b, task.gray_b))
+
+                self.results.append(record)
+
+        timer.stop_timer()
+
+        self.time = timer.get_elapsed()
+        self.date = timer.get_date_time()
+
+        print('Compared {} page pairs in {:.3f}s -- [read: {:.3f}s / {:.3f}s]\n'.format(
+            len(self.results), self.time, self.pdf_a.read_time, self.pdf_b.read_time))
+
+        # Write all the results in one go
+        if self.isreporting:
+            reporter = ImageComparisonReporter(self.folder.path, backend=self.backend)
+            reporter.create_batch_report(self.results)
+
+        return self.results
@@ -26,18 +26,19 @@ from pdfcu.report import PdfConversionReporter
 
 class PdfConvertTask(Task):
 
-    def __init__(self, subj_path, gen_path, report=False):
+    def __init__(self, subj_path, gen_path, report=False, res=320, workers=1, cache=None, backend='csv', window=1):
 
         super(PdfConvertTask, self).__init__(subj_path)
 
         self.subject = PdfFile(subj_path)
-        self.generator = GenerateConvertTask(gen_path)
+        self.generator = GenerateConvertTask(gen_path, workers, cache, window)
         self.group = None
         self.reporter = None
         self.isreporting = report
+        self.backend = backend
 
-        # Read the PDF file under 320 resolution
-        self.subject.read_pdf(res=320)
+        # The PDF file is read page by page under this resolution during conversion
+        self.resolution = res
 
     def set_group(self, grpname=None, subfolders: list=None):
         if grpname is None:
@@ -58,12 +59,12 @@ class PdfConvertTask(Task):
             self.set_group()
 
         # Generate JPG file from a given converted PDF file
-        self.generator.generate_image(self.subject, imgformat, self.group, pages=pages)
+        self.generator.generate_image(self.subject, imgformat, self.group, pages=pages, res=self.resolution)
 
         # Conversion elapsed time
         self.subject.conversion_time()
 
         # Reporting
         if self.isreporting:
-            self.reporter = PdfConversionReporter(self.group, self.subject, self.generator.image_files)
+            self.reporter = PdfConversionReporter(self.group, self.subject, self.generator.image_files, self.backend)
             self.reporter.create_report()
@@ -0,0 +1,348 @@
+
+# *************************************************************************************
+
+# MODULE NAME: distribute.py
+
+# SYS-REQ: PDFC-SYS-XXX
+
+# SW-REQ: PDFC-SRS-XXX
+
+# MODULE DESCRIPTION: This module spreads the conversion/comparison jobs of a session over
+#                     several hosts. A coordinator enumerates the PDF/page pairs into a
+#                     work queue (a SQLite file on the shared storage), workers claim the
+#                     jobs under a lease, post their results, and the results are merged
+#                     into the session report for the ReportGleaner.
+
+# REVISION HISTORY:
+#   $Id$
+#   PCR# N/A
+#   Initial Development
+
+# *************************************************************************************
+
+
+from pdfcu.pdfc import Task, Folder, Timer
+from pdfcu.convert import PdfConvertTask
+from pdfcu.compare import ImageCompareTask, FolderCompareTask
+from pdfcu.generate import ArtifactWriter
+from pdfcu.records import ComparisonRecord
+from pdfcu.report import ImageComparisonReporter
+from threading import Thread, Event
+import traceback
+import sqlite3
+import socket
+import json
+import time
+import os
+
+
+class WorkQueue(Task):
+
+    FILENAME = '_queue.sqlite'
+
+    JOB_COLUMNS = [('id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+                   ('kind', 'TEXT'),
+                   ('payload', 'TEXT'),
+                   ('state', 'TEXT'),
+                   ('worker', 'TEXT'),
+                   ('lease_until', 'REAL'),
+                   ('attempts', 'INTEGER'),
+                   ('max_attempts', 'INTEGER'),
+                   ('result', 'TEXT'),
+                   ('error', 'TEXT'),
+                   ('merged', 'INTEGER'),
+                   ('updated', 'REAL')]
+
+    def __init__(self, queue_folder, max_attempts=3):
+        super(WorkQueue, self).__init__(queue_folder)
+
+        self.folder = Folder(queue_folder)
+        self.file = os.path.join(self.folder.path, self.FILENAME)
+
+        # a job whose worker crashed (lease expired) is retried until it failed this many times (set per job
+        # when it is queued)
+        self.max_attempts = max_attempts
+
+    def connect(self):
+        # Rollback journal (no WAL): WAL needs shared memory, i.e. all the processes on one host
+        con = sqlite3.connect(self.file, timeout=60, isolation_level=None)
+        columns = ', '.join('{} {}'.format(*c) for c in self.JOB_COLUMNS)
+        con.execute('CREATE TABLE IF NOT EXISTS jobs ({})'.format(columns))
+        con.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_until)')
+        return con
+
+    def transaction(self, func, *args):
+        # Run func(con, *args) in a write transaction, taken before any read so claims never race
+        con = self.connect()
+        try:
+            con.execute('BEGIN IMMEDIATE')
+            try:
+                result = func(con, *args)
+            except BaseException:
+                con.execute('ROLLBACK')
+                raise
+            con.execute('COMMIT')
+            return result
+        finally:
+            con.close()
+
+    def enqueue(self, kind, payloads: list):
+        now = time.time()
+        rows = [(kind, json.dumps(payload), 'pending', None, None, 0, self.max_attempts, None, None, 0, now)
+                for payload in payloads]
+
+        def insert(con):
+            con.executemany('INSERT INTO jobs (kind, payload, state, worker, lease_until, attempts, max_attempts, '
+                            'result, error, merged, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+        self.transaction(insert)
+
+    def expire(self, con):
+        # Jobs whose lease expired (crashed worker) go back in the queue, or fail after max_attempts
+        now = time.time()
+        cur = con.execute("UPDATE jobs SET state = CASE WHEN attempts >= max_attempts THEN 'failed' "
+                          "ELSE 'pending' END, worker = NULL, lease_until = NULL, "
+                          "error = COALESCE(error, 'lease expired'), updated = ? "
+                          "WHERE state = 'running' AND lease_until < ?", (now, now))
+        return cur.rowcount
+
+    def reap(self):
+        return self.transaction(self.expire)
+
+    def claim(self, worker, lease=300):
+        # Take the next pending job, the jobs of crashed workers are re-queued first
+
+        def take(con):
+            self.expire(con)
+
+            row = con.execute("SELECT id, kind, payload FROM jobs WHERE state = 'pending' "
+                              "ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+
+            now = time.time()
+            con.execute("UPDATE jobs SET state = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                        "updated = ? WHERE id = ?", (worker, now + lease, now, row[0]))
+
+            return row[0], row[1], json.loads(row[2])
+
+        return self.transaction(take)
+
+    def renew(self, job_id, worker, lease=300):
+        # Extend the lease of a job still owned by the worker, False if it was lost
+        def extend(con):
+            now = time.time()
+            cur = con.execute("UPDATE jobs SET lease_until = ?, updated = ? "
+                              "WHERE id = ? AND worker = ? AND state = 'running'", (now + lease, now, job_id, worker))
+            return cur.rowcount == 1
+
+        return self.transaction(extend)
+
+    def complete(self, job_id, worker, result):
+        def done(con):
+            cur = con.execute("UPDATE jobs SET state = 'done', result = ?, error = NULL, lease_until = NULL, "
+                              "updated = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                              (json.dumps(result), time.time(), job_id, worker))
+            return cur.rowcount == 1
+
+        return self.transaction(done)
+
+    def fail(self, job_id, worker, error):
+        # Put the job back in the queue, or give up on it after max_attempts
+        def failed(con):
+            cur = con.execute("UPDATE jobs SET state = CASE WHEN attempts >= max_attempts THEN 'failed' "
+                              "ELSE 'pending' END, error = ?, lease_until = NULL, updated = ? "
+                              "WHERE id = ? AND worker = ? AND state = 'running'",
+                              (error, time.time(), job_id, worker))
+            return cur.rowcount == 1
+
+        return self.transaction(failed)
+
+    def status(self):
+        con = self.connect()
+        try:
+            return dict(con.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+        finally:
+            con.close()
+
+    def take_results(self):
+        # Results of the finished jobs not merged yet, they are flagged as merged
+
+        def take(con):
+            rows = con.execute("SELECT id, result FROM jobs WHERE state = 'done' AND merged = 0 ORDER BY id").fetchall()
+            con.executemany('UPDATE jobs SET merged = 1 WHERE id = ?', [(job_id,) for job_id, _ in rows])
+            return [(job_id, json.loads(result)) for job_id, result in rows]
+
+        return self.transaction(take)
+
+    def failures(self):
+        con = self.connect()
+        try:
+            return con.execute("SELECT id, kind, payload, attempts, error FROM jobs WHERE state = 'failed' "
+                               "ORDER BY id").fetchall()
+        finally:
+            con.close()
+
+
+class CompareCoordinator(Task):
+    def __init__(self, session_folder, queue_folder=None, max_attempts=3, backend='csv'):
+        super(CompareCoordinator, self).__init__(session_folder)
+
+        self.folder = Folder(session_folder)
+        self.queue = WorkQueue(queue_folder or self.folder.path, max_attempts)
+        self.backend = backend
+
+    def enqueue_pdf_pairs(self, pairs, res=320):
+        # one job per PDF pair: convert both PDFs, then compare their pages
+        self.queue.enqueue('pdf', [{'pdf_a': os.path.abspath(a), 'pdf_b': os.path.abspath(b), 'res': res}
+                                   for a, b in pairs])
+
+    def enqueue_page_pairs(self, pairs):
+        # one job per page image pair
+        self.queue.enqueue('page', [{'image_a': os.path.abspath(a), 'image_b': os.path.abspath(b)} for a, b in pairs])
+
+    def wait(self, poll=10, timeout=None):
+        # Block until every job is done or failed (or timeout seconds), the jobs of crashed workers are reaped on the
+        # way so they do not stay 'running' forever
+        deadline = None if timeout is None else time.time() + timeout
+
+        while True:
+            self.queue.reap()
+
+            status = self.queue.status()
+            if not status.get('pending') and not status.get('running'):
+                return status
+
+            if deadline is not None and time.time() >= deadline:
+                raise TimeoutError('Jobs not finished after {}s: {}'.format(timeout, status))
+
+            time.sleep(poll)
+
+    def merge(self):
+        # Append the results of the finished jobs to the session comparison report (see ReportGleaner)
+        records = [ComparisonRecord.from_row(row) for job_id, rows in self.queue.take_results() for row in rows]
+
+        if records:
+            reporter = ImageComparisonReporter(self.folder.path, backend=self.backend)
+            reporter.create_batch_report(records)
+
+        for job_id, kind, payload, attempts, error in self.queue.failures():
+            print('Job {} ({}) failed after {} attempts: {}\n{}'.format(job_id, kind, attempts, payload, error))
+
+        print('Merged {} comparison results'.format(len(records)))
+
+        return records
+
+
+class CompareWorker(Task):
+    def __init__(self, session_folder, queue_folder=None, worker=None, lease=300, workers=1, ssim_args=None,
+                 cache=None, result_cache=None, writer_threads=2, max_pending=8):
+        super(CompareWorker, self).__init__(session_folder)
+
+        self.folder = Folder(session_folder)
+        self.queue = WorkQueue(queue_folder or self.folder.path)
+        self.name = worker or '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.lease = lease
+        self.workers = workers
+        self.ssim_args = ssim_args
+        self.cache = cache
+        self.result_cache = result_cache
+        self.jobs = 0
+
+        # artifact writer stage of the running job (see ArtifactWriter)
+        self.writer_threads = writer_threads
+        self.max_pending = max_pending
+        self.writer = None
+
+    def run(self, poll=10, wait=False):
+        # Claim and run jobs until the queue is empty (or forever with wait)
+        while True:
+            job = self.queue.claim(self.name, self.lease)
+
+            if job is None:
+                if not wait:
+                    break
+                time.sleep(poll)
+                continue
+
+            self.run_job(*job)
+
+        print('Worker {} ran {} jobs'.format(self.name, self.jobs))
+
+    def run_job(self, job_id, kind, payload):
+        timer = Timer('Job {}'.format(job_id))
+
+        timer.start_timer()
+
+        # keep the lease alive while the job runs
+        stop = Event()
+        heartbeat = Thread(target=self.heartbeat, args=(job_id, stop), daemon=True)
+        heartbeat.start()
+
+        error = None
+        try:
+            # the job's artifacts are written while it goes on, all written before its result is posted
+            with ArtifactWriter(self.writer_threads, self.max_pending) as self.writer:
+                if kind == 'pdf':
+                    records = self.compare_pdfs(job_id, payload)
+                elif kind == 'page':
+                    records = self.compare_pages(job_id, payload)
+                else:
+                    raise NameError('Job kind not supported: {}'.format(kind))
+
+        except Exception:
+            error = traceback.format_exc()
+
+        finally:
+            # the lease is no longer renewed once the job is over (or interrupted)
+            stop.set()
+            heartbeat.join()
+            self.writer = None
+
+        if error is not None:
+            self.queue.fail(job_id, self.name, error)
+            print('Job {} failed'.format(job_id))
+            return
+
+        if not self.queue.complete(job_id, self.name, [list(record) for record in records]):
+            print('Job {} lease was lost, its result is dropped'.format(job_id))
+
+        timer.stop_timer()
+
+        self.jobs += 1
+        print('Job {} ({}) done in {:.3f}s'.format(job_id, kind, timer.get_elapsed()))
+
+    def heartbeat(self, job_id, stop: Event):
+        while not stop.wait(self.lease / 3.0):
+            if not self.queue.renew(job_id, self.name, self.lease):
+                return
+
+    def job_folder(self, job_id, *subfolders):
+        # every job writes into its own folders, no two workers write the same files
+        return self.folder.add_subfolders(list(subfolders) + ['job_{:05d}'.format(job_id)])
+
+    def compare_pdfs(self, job_id, payload):
+        groups = []
+
+        # each side in its own group, the two PDFs may have the same name (e.g. v1/manual.pdf vs v2/manual.pdf)
+        for side, pdf in (('a', payload['pdf_a']), ('b', payload['pdf_b'])):
+            task = PdfConvertTask(pdf, self.job_folder(job_id, 'converted'), report=True, res=payload['res'],
+                                  workers=self.workers, cache=self.cache)
+            task.set_group(side)
+            task.pdf_to_image([])
+            groups.append(task.group)
+
+        task = FolderCompareTask(self.job_folder(job_id, 'compare'), groups[0], groups[1], report=False,
+                                 typ='distributed', workers=self.workers, ssim_args=self.ssim_args,
+                                 result_cache=self.result_cache, writer_threads=self.writer_threads,
+                                 max_pending=self.max_pending)
+
+        return task.compare_folders()
+
+    def compare_pages(self, job_id, payload):
+        task = ImageCompareTask(self.job_folder(job_id, 'compare'), report=False, typ='distributed',
+                                ssim_args=self.ssim_args, result_cache=self.result_cache, writer=self.writer)
+        task.read_images(payload['image_a'], payload['image_b'])
+        task.compare_images()
+
+        return [ComparisonRecord.from_task(task)]
@@ -20,23 +20,103 @@
 
 
 from pdfcu.pdfc import Task, ImageFile, PdfFile, Folder, Timer
-from wand.image import Image
+from pdfcu.records import PageRecord
 from wand.color import Color
+from concurrent.futures import ProcessPoolExecutor
+from threading import Thread
+from queue import Queue
+from numpy import empty, zeros, frombuffer
 import cv2
 import imutils
 import os
 
 
+def render_pages(subj: PdfFile, pages, out_folder, img_ext, res=320, cache=None, window=1):
+    # Render/save the given pages (all if None), taking the cached ones from the page cache
+    if subj.page_count is None:
+        subj.page_count = subj.count_pages()
+
+    if pages is None:
+        pages = range(1, subj.page_count + 1)
+
+    outputs = {}
+    for pg in pages:
+        # Extract filename then replace extension
+        img_name = GenerateConvertTask.assemble_genfilename(subj.filename, pg, img_ext)
+
+        # Create path where to write/save the page
+        outputs[pg] = os.path.join(out_folder, img_name)
+
+    pending = list(outputs)
+    keys = {}
+
+    if cache is not None:
+        for pg in pending:
+            keys[pg] = cache.page_key(subj.content_hash(), pg, res, img_ext,
+                                      GenerateConvertTask.BACKGROUND, GenerateConvertTask.ALPHA)
+
+        pending = [pg for pg in pending if not cache.fetch(keys[pg], img_ext, outputs[pg])]
+
+    subj.read_time = 0.0
+    infos = {}
+
+    # Pages are rasterized a window at a time and written as soon as they are read
+    if pending:
+        for pg, page in subj.stream_pdf(res, window, pages=pending):
+            GenerateConvertTask.save_page(page, outputs[pg])
+
+            # keep the metadata of the rendered page, no need to open the written file again
+            infos[pg] = ImageFile.image_info(page, GenerateConvertTask.IMAGE_FORMATS.get(img_ext))
+
+            if cache is not None:
+                cache.store(keys[pg], img_ext, outputs[pg])
+
+    # written files, metadata of the rendered pages, cache hits and cache misses
+    return outputs, infos, len(outputs) - len(pending), len(pending)
+
+
+def render_page_shard(pdf_path, pages, out_folder, img_ext, res=320, cache=None, digest=None, window=1):
+    # Worker process: open the PDF on its own and render/save its shard of pages
+    timer = Timer('Shard Render Timer')
+
+    timer.start_timer()
+
+    subj = PdfFile(pdf_path)
+    subj.digest = digest
+
+    outputs, infos, hits, misses = render_pages(subj, pages, out_folder, img_ext, res, cache, window)
+
+    timer.stop_timer()
+
+    elapsed = timer.get_elapsed()
+
+    # rendered page records, read time, write time, cache hits and misses of this worker
+    return [GenerateConvertTask.page_record(outputs[pg], infos.get(pg), pg) for pg in pages], \
+        subj.read_time, elapsed - subj.read_time, hits, misses
+
+
 class GenerateConvertTask(Task):
 
-    def __init__(self, output_folder):
+    # page flattening settings (part of the page cache key)
+    BACKGROUND = 'white'
+    ALPHA = 'remove'
+
+    # image format of the written pages by extension
+    IMAGE_FORMATS = {'.jpg': 'JPEG', '.png': 'PNG', '.bmp': 'BMP', '.svg': 'SVG'}
+
+    def __init__(self, output_folder, workers=1, cache=None, window=1):
 
         super(GenerateConvertTask, self).__init__(output_folder)
 
         self.folder = Folder(output_folder)
         self.image_files = None
+        self.workers = workers
+        self.cache = cache
+
+        # pages rasterized per read of the PDF (see PdfFile.stream_pdf), all held in memory
+        self.window = window
 
-    def generate_image(self, subj, img_form='JPG', group=None, pages=list()):
+    def generate_image(self, subj, img_form='JPG', group=None, pages=list(), res=320):
 
         try:
 
@@ -59,12 +139,12 @@ class GenerateConvertTask(Task):
                 if pages:
 
                     if pages[0] == 'ALL':
-                        self.image_files = self.generate_page_images_all(group, subj, img_ext)
+                        self.image_files = self.generate_page_images_all(group, subj, img_ext, res)
                     else:
-                        self.image_files = self.generate_page_images_sel(group, subj, img_ext, pages)
+                        self.image_files = self.generate_page_images_sel(group, subj, img_ext, pages, res)
 
                 else:
-                    self.image_files = self.generate_page_images_all(group, subj, img_ext)
+                    self.image_files = self.generate_page_images_all(group, subj, img_ext, res)
 
         except AttributeError as e:
             print(e)
@@ -73,11 +153,41 @@ class GenerateConvertTask(Task):
         except NameError as e:
             print(e)
 
+    @staticmethod
+    def page_record(output, info, page):
+        # Pages not rendered now (cached/skipped) take their metadata from the file header
+        if info is None:
+            return PageRecord.from_file(output, page)
+        return PageRecord.from_info(output, info, page)
+
     @staticmethod
     def assemble_genfilename(filename, page, ext):
         return filename.rsplit('.', 1)[0] + '__pg_' + '{:02d}'.format(page) + ext
 
-    def generate_page_images_all(self, out_folder, subj: PdfFile, img_ext):
+    @classmethod
+    def flatten_page(cls, page):
+        # Flatten the page on a white background
+        page.background_color = Color(cls.BACKGROUND)
+        page.alpha_channel = cls.ALPHA
+
+    @classmethod
+    def save_page(cls, page, output):
+        # Flatten the page then write/save it
+        cls.flatten_page(page)
+        page.save(filename=output)
+
+    @classmethod
+    def page_array(cls, page):
+        # Flatten the page then take its 8-bit grayscale pixels as a (height, width) array, nothing is written
+        cls.flatten_page(page)
+        page.depth = 8
+        return frombuffer(page.make_blob('gray'), dtype='uint8').reshape(page.height, page.width)
+
+    def generate_page_images_all(self, out_folder, subj: PdfFile, img_ext, res=320):
+
+        # Spread the pages over a pool of render processes
+        if self.workers is None or self.workers > 1:
+            return self.generate_page_images_pool(out_folder, subj, img_ext, res)
 
         timer = Timer('Image Write Timer')
 
@@ -86,64 +196,65 @@ class GenerateConvertTask(Task):
         # img_name = str(subj.filename).replace(ext, img_ext)
         # output = os.path.join(out_folder, img_name)
 
-        img_list = []
-
         timer.start_timer()
 
-        for i in range(subj.page_count):
-            # Extract filename then replace extension
-            img_name = self.assemble_genfilename(subj.filename, i+1, img_ext)
-
-            # Create path where to write/save JPG files
-            output = os.path.join(out_folder, img_name)
+        outputs, infos, hits, misses = render_pages(subj, None, out_folder, img_ext, res, self.cache, self.window)
 
-            # Write/Save JPG
-            image = Image(subj.page_list[i])
-            image.background_color = Color("white")
-            image.alpha_channel = 'remove'
-            image.save(filename=output)
+        if self.cache is not None:
+            subj.cache_hits, subj.cache_misses = hits, misses
 
-            img = ImageFile(output)
-
-            # add the image to the list
-            img_list.append(img)
+        # take image information (cached pages are read from their file header)
+        img_list = [self.page_record(outputs[pg], infos.get(pg), pg) for pg in sorted(outputs)]
 
         timer.stop_timer()
 
         subj.date = timer.get_date_time()
 
-        # store the write elapsed time
-        subj.write_time = timer.get_elapsed()
+        # store the write elapsed time (reading is accounted in subj.read_time)
+        subj.write_time = timer.get_elapsed() - subj.read_time
 
         return img_list
 
-    def generate_page_images_sel(self, out_folder, subj: PdfFile, img_ext, pg_list):
+    def generate_page_images_sel(self, out_folder, subj: PdfFile, img_ext, pg_list, res=320):
         timer = Timer('Image Write Timer')
 
         img_list = []
 
         timer.start_timer()
 
+        # Pages beyond the document are reported, no image record is made for them
+        pg_list = subj.select_pages(pg_list)
+
+        pending = []
         for i in pg_list:
             # Extract filename then replace extension
             img_name = self.assemble_genfilename(subj.filename, i, img_ext)
 
-            # Create path where to write/save JPG files
-            output = os.path.join(out_folder, img_name)
-
-            # Check if the file already exist
-            if os.path.isfile(output):
+            # Check if the file already exist (with a page cache the source PDF may have changed, always check the
+            # cache)
+            if self.cache is None and os.path.isfile(os.path.join(out_folder, img_name)):
                 print('Skipped (file already exist): {}'.format(img_name))
             else:
-                # Write/Save JPG
-                print('Generating converted image: {}'.format(img_name))
-                image = Image(subj.page_list[i-1])
-                image.background_color = Color("white")
-                image.alpha_channel = 'remove'
-                image.save(filename=output)
+                # with a page cache the pages are reported once known to be cached or rendered (below)
+                if self.cache is None:
+                    print('Generating converted image: {}'.format(img_name))
+                pending.append(i)
+
+        # Rasterize only the pages still to be generated
+        outputs, infos, hits, misses = render_pages(subj, pending, out_folder, img_ext, res, self.cache, self.window)
 
-            # take image information
-            img = ImageFile(output)
+        if self.cache is not None:
+            subj.cache_hits, subj.cache_misses = hits, misses
+
+            for i in pending:
+                # rendered pages have their metadata in infos, the others came from the cache
+                print('{}: {}'.format('Generated converted image' if i in infos else 'Taken from the page cache',
+                                      os.path.basename(outputs[i])))
+
+        for i in pg_list:
+            # take image information (skipped/cached pages are read from their file header)
+            img_path = os.path.join(out_folder, self.assemble_genfilename(subj.filename, i, img_ext))
+            img = self.page_record(img_path, infos.get(i), i)
 
             # add the image to the list
             img_list.append(img)
@@ -152,46 +263,215 @@ class GenerateConvertTask(Task):
 
         subj.date = timer.get_date_time()
 
-        # store the write elapsed time
-        subj.write_time = timer.get_elapsed()
+        # store the write elapsed time (reading is accounted in subj.read_time)
+        subj.write_time = timer.get_elapsed() - subj.read_time
 
         return img_list
 
+    @staticmethod
+    def shard_pages(pages, shards):
+        # Split the pages into contiguous ranges, one per worker
+        n = len(pages)
+        chunks = [pages[i * n // shards:(i + 1) * n // shards] for i in range(shards)]
+        return [chunk for chunk in chunks if chunk]
+
+    def generate_page_images_pool(self, out_folder, subj: PdfFile, img_ext, res=320, pg_list=None):
+
+        timer = Timer('Image Write Timer')
+
+        timer.start_timer()
+
+        # Store page count
+        if subj.page_count is None:
+            subj.page_count = subj.count_pages()
+
+        if pg_list is None:
+            pg_list = list(range(1, subj.page_count + 1))
+
+        workers = self.workers or os.cpu_count()
+        shards = self.shard_pages(pg_list, max(1, min(workers, len(pg_list))))
+
+        # hash the PDF once for all the workers
+        digest = subj.content_hash() if self.cache is not None else None
+
+        outputs = []
+        subj.worker_times = []
+        hits = misses = 0
+
+        with ProcessPoolExecutor(max_workers=len(shards) or 1) as pool:
+            futures = [pool.submit(render_page_shard, subj.path, shard, out_folder, img_ext, res, self.cache, digest,
+                                   self.window) for shard in shards]
+
+            for future in futures:
+                records, read_time, write_time, shard_hits, shard_misses = future.result()
+                outputs.extend(records)
+                subj.worker_times.append((read_time, write_time))
+                hits += shard_hits
+                misses += shard_misses
+
+        if self.cache is not None:
+            subj.cache_hits, subj.cache_misses = hits, misses
+
+        # image information of the pages
+        img_list = outputs
+
+        timer.stop_timer()
+
+        subj.date = timer.get_date_time()
+
+        # Split the wall time into read/write in proportion to the time the workers spent on each
+        wall = timer.get_elapsed()
+        busy_read = sum(r for r, w in subj.worker_times)
+        busy = busy_read + sum(w for r, w in subj.worker_times)
+
+        subj.read_time = wall * busy_read / busy if busy else 0.0
+        subj.write_time = wall - subj.read_time
+
+        return img_list
+
+
+class ArtifactWriter:
+    """Background stage encoding/writing the comparison images.
+
+    Writes are queued to a few writer threads (cv2 releases the GIL while
+    encoding) so the next comparison runs while the previous images are
+    written. At most `max_pending` images wait in the queue, `write` blocks
+    beyond that to keep the memory bounded.
+    """
+
+    def __init__(self, threads=2, max_pending=8):
+        self.queue = Queue(maxsize=max_pending)
+        self.failed = []
+        self.threads = [Thread(target=self.run, daemon=True) for _ in range(threads)]
+
+        for thread in self.threads:
+            thread.start()
+
+    def write(self, out_path, img):
+        self.queue.put((out_path, img))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                # end of the stage
+                if item is None:
+                    return
+
+                out_path, img = item
+                if not cv2.imwrite(out_path, img):
+                    self.failed.append(out_path)
+
+            except Exception as e:
+                # any error is recorded, a dead writer thread would leave write() blocked on a full queue
+                self.failed.append('{} ({})'.format(item[0], e))
+
+            finally:
+                self.queue.task_done()
+
+    def close(self):
+        # Let the queued writes finish then stop the writer threads
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+        if self.failed:
+            raise IOError('Failed to write: {}'.format(', '.join(self.failed)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+            return
+
+        # an exception is already propagating, the write failures are only reported
+        try:
+            self.close()
+        except IOError as e:
+            print(e)
+
 
 class GenerateCompareTask(Task):
 
-    def __init__(self, session_folder):
+    def __init__(self, session_folder, writer: ArtifactWriter = None):
 
         super(GenerateCompareTask, self).__init__(session_folder)
 
-    @staticmethod
-    def generate_diff(diff, out_path):
+        # images are written inline unless an artifact writer stage is given
+        self.writer = writer
 
-        diff_img = (diff * 255).astype('uint8')
-        cv2.imwrite(out_path, diff_img)
+    def write_image(self, out_path, img):
+        if self.writer is not None:
+            self.writer.write(out_path, img)
+        else:
+            cv2.imwrite(out_path, img)
+
+    def generate_diff(self, diff, out_path, rows=1024):
+
+        # Scaled to 8 bits a block of rows at a time, no full size floating point temporary
+        diff_img = empty(diff.shape, dtype='uint8')
+        for r0 in range(0, diff.shape[0], rows):
+            diff_img[r0:r0 + rows] = (diff[r0:r0 + rows] * 255).astype('uint8')
+
+        self.write_image(out_path, diff_img)
         return diff_img
 
-    @staticmethod
-    def generate_thres(diff, out_path):
+    def generate_thres(self, diff, out_path, roi_blocks=None):
+
+        if roi_blocks is None:
+            thres_img = cv2.threshold(diff, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+        else:
+            # Threshold only the regions of interest of a pyramid SSIM (y0, y1, x0, x1), the rest is unchanged
+            thres_img = zeros(diff.shape, dtype='uint8')
+            for (y0, y1, x0, x1) in roi_blocks:
+                thres_img[y0:y1, x0:x1] = cv2.threshold(diff[y0:y1, x0:x1], 0, 255,
+                                                        cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
 
-        thres_img = cv2.threshold(diff, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
-        cv2.imwrite(out_path, thres_img)
+        self.write_image(out_path, thres_img)
         return thres_img
 
     @staticmethod
-    def generate_marks(thres, alpha_a, alpha_b, out_path: []):
+    def generate_marks(thres):
 
         # Find contours to obtain the regions of the two input images that differ
         contours = cv2.findContours(thres.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        contours = contours[0] if imutils.is_cv2() else contours[1]
+        contours = imutils.grab_contours(contours)
+
+        # Bounding box (x, y, w, h) of every contour, the marks are kept as this list only
+        return [tuple(int(v) for v in cv2.boundingRect(contour)) for contour in contours]
 
-        # Loop over the contours
-        for contour in contours:
-            # Compute the bounding box of the contour
-            (x, y, w, h) = cv2.boundingRect(contour)
+    def generate_crops(self, marks, gray_a, gray_b, out_prefix, margin=8):
+        # Small images of each marked region of both pages (out_prefix_NNN_a.png / _b.png)
+        height, width = gray_a.shape[:2]
+        crops = []
+
+        for i, (x, y, w, h) in enumerate(marks):
+            y0, y1 = max(y - margin, 0), min(y + h + margin, height)
+            x0, x1 = max(x - margin, 0), min(x + w + margin, width)
+
+            crop = ['{}_{:03d}_a.png'.format(out_prefix, i), '{}_{:03d}_b.png'.format(out_prefix, i)]
+            self.write_image(crop[0], gray_a[y0:y1, x0:x1].copy())
+            self.write_image(crop[1], gray_b[y0:y1, x0:x1].copy())
+            crops.append(crop)
+
+        return crops
+
+    def render_marks(self, marks, size, out_path: []):
+        # Full size overlays of the marks, only rendered on demand (size is (width, height))
+        width, height = size
+        alpha_a = zeros((height, width, 4), dtype='uint8')
+        alpha_b = zeros((height, width, 4), dtype='uint8')
+
+        # Loop over the marks
+        for (x, y, w, h) in marks:
             # Draw the bounding box on both input alpha images, this represents where the two images differ
             cv2.rectangle(alpha_a, (x, y), (x + w, y + h), (255, 128, 0, 255), 5)
             cv2.rectangle(alpha_b, (x, y), (x + w, y + h), (0, 128, 255, 255), 5)
 
-        cv2.imwrite(out_path[0], alpha_a)
-        cv2.imwrite(out_path[1], alpha_b)
+        self.write_image(out_path[0], alpha_a)
+        self.write_image(out_path[1], alpha_b)
+
+        return out_path
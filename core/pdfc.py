@@ -1,55 +1,167 @@
 
 import os
+import re
+import mmap
+import hashlib
 import time
 import logging
+import logging.handlers
+import multiprocessing
+import multiprocessing.util
+from queue import Queue
 from wand.image import Image
 
 
+# Trailer/catalog references and page count of an uncompressed page tree, see PdfFile.scan_page_count
+_PDF_ROOT = re.compile(rb'/Root\s+(\d+)\s+(\d+)\s+R')
+_PDF_PAGES = re.compile(rb'/Pages\s+(\d+)\s+(\d+)\s+R')
+_PDF_COUNT = re.compile(rb'/Count\s+(\d+)')
+
+
+LOG_FILE = "pdfcu_log.txt"
+LOG_FORMAT = "%(asctime)s.%(msecs)03d: [%(levelname)s] :: ( %(name)s ) :: %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Module logger, the Folder/File checks are logged by its per class children (e.g. pdfcu.pdfc.Folder)
+log = logging.getLogger(__name__)
+
+# listener thread, queue handler, file and process of the current log configuration
+_log_listener = None
+_log_handler = None
+_log_file = None
+_log_pid = None
+
+
+def configure_logging(filename=LOG_FILE, level=logging.INFO, path_info=True):
+    """Set up the pdfcu log (once per process, done on the first Path otherwise).
+
+    Records are handed to a queue and written to the file by a background
+    listener thread, logging never blocks on the file. With `path_info`
+    False the INFO records of every folder/file check are dropped, their
+    warnings and errors are still logged. A forked process (e.g. a
+    ProcessPoolExecutor worker) inherits the queue handler but not the
+    listener thread, it starts a listener of its own appending to the
+    same file.
+    """
+    log.setLevel(logging.NOTSET if path_info else logging.WARNING)
+
+    if _log_pid == os.getpid():
+        return
+
+    # worker processes append to the log of the main process
+    filemode = 'a' if _log_pid is not None or multiprocessing.parent_process() is not None else 'w'
+
+    _start_log_listener(filename, level, filemode)
+
+
+def _start_log_listener(filename, level, filemode):
+    global _log_listener, _log_handler, _log_file, _log_pid
+
+    package_log = logging.getLogger(__name__.split('.')[0])
+
+    # drop the handler inherited from the parent process, nothing drains its queue here
+    if _log_handler is not None:
+        package_log.removeHandler(_log_handler)
+
+    handler = logging.FileHandler(filename, mode=filemode)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+
+    queue = Queue()
+    _log_listener = logging.handlers.QueueListener(queue, handler)
+    _log_listener.start()
+
+    # flushed on exit, worker processes included (they leave through os._exit, atexit is not run there)
+    multiprocessing.util.Finalize(_log_listener, _log_listener.stop, exitpriority=0)
+
+    _log_handler = logging.handlers.QueueHandler(queue)
+    _log_file = filename
+    _log_pid = os.getpid()
+
+    package_log.setLevel(level)
+    package_log.addHandler(_log_handler)
+
+
+def _restart_log_listener(logger):
+    # Fork started worker process: log through a listener of its own (at the parent's level)
+    if _log_pid is not None and _log_pid != os.getpid():
+        _start_log_listener(_log_file, logging.getLogger(__name__.split('.')[0]).level, 'a')
+
+
+multiprocessing.util.register_after_fork(log, _restart_log_listener)
+
+
 class Path:
+
+    log = log
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.log = log.getChild(cls.__name__)
+
     def __init__(self):
         self.path = None
-        self.log = None
 
-        # Initialize a logger
-        LOG_FORMAT = "%(asctime)s.%(msecs)03d: [%(levelname)s] :: ( %(name)s ) :: %(message)s"
-        DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
-        logging.basicConfig(filename="pdfcu_log.txt",
-                            filemode='w',
-                            level=logging.INFO,
-                            format=LOG_FORMAT,
-                            datefmt=DATE_FORMAT)
-        self.log = logging.getLogger(name=self.__class__.__name__)
+        # Configure the log on first use (in this process)
+        if _log_pid != os.getpid():
+            configure_logging()
 
 
 class Folder(Path):
+
+    # absolute paths of the folders already checked/created by this process
+    _registry = set()
+
     def __init__(self, directory):
         super(Folder, self).__init__()
         self.foldername = None
 
+        # resolved subfolder paths of this folder (see add_subfolders)
+        self._subfolders = {}
+
         try:
+            path = os.path.abspath(directory)
+
+            if path in Folder._registry:
+                # Known folder, no filesystem check needed
+                self.path = path
+
             # Check if provided argument is an existing directory
-            if not os.path.isdir(directory):
-                os.makedirs(directory)
-                self.path = os.path.abspath(directory)
-                self.log.info('Folder created: {}'.format(self.path))
+            elif not os.path.isdir(directory):
+                os.makedirs(directory, exist_ok=True)
+                self.path = path
+                self.log.info('Folder created: %s', self.path)
             else:
                 # Folder already exist, take the absolute path
-                self.path = os.path.abspath(directory)
-                self.log.info('Folder already exist: {}'.format(self.path))
-            
+                self.path = path
+                self.log.info('Folder already exist: %s', self.path)
+
+            Folder._registry.add(self.path)
+
             if self.path:
-                self.foldername = self.path.split('\\')[-1]
+                self.foldername = os.path.basename(self.path)
 
         except TypeError:
             self.log.error('Failed to create folder', exc_info=True)
 
+    @classmethod
+    def forget(cls, path=None):
+        # Check the folder (or all the folders) again next time, e.g. after removing it
+        if path is None:
+            cls._registry.clear()
+        else:
+            cls._registry.discard(os.path.abspath(path))
+
     def add_subfolder(self, folder):
-        sub = Folder(os.path.join(self.path, folder))
-        return sub.path
+        return self.add_subfolders([folder])
 
     def add_subfolders(self, folders: list):
-        sub = Folder(os.path.join(self.path, *folders))
-        return sub.path
+        key = tuple(folders)
+
+        if key not in self._subfolders:
+            sub = Folder(os.path.join(self.path, *folders))
+            self._subfolders[key] = sub.path
+
+        return self._subfolders[key]
 
 
 class File(Path):
@@ -59,22 +171,34 @@ class File(Path):
         self.filename = None
         self.extension = None
         self.exists = False
+        self.digest = None
 
         # Check if the provided argument is an existing file
         if os.path.isfile(filepath):
             self.exists = True
             self.path = os.path.abspath(filepath)
-            self.filename = str(self.path.split('\\')[-1])
+            self.filename = str(os.path.basename(self.path))
             self.extension = self.filename.split('.')[-1]
-            self.log.info('File exist: {}'.format(filepath))
+            self.log.info('File exist: %s', filepath)
         else:
             e = 'Invalid FILEPATH: {}'.format(filepath)
             self.log.error(e)
             print(e)
 
+    def content_hash(self):
+        # Hash the file content once (chunked read), then reuse it
+        if self.digest is None and self.exists:
+            h = hashlib.sha1()
+            with open(self.path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            self.digest = h.hexdigest()
+
+        return self.digest
+
 
 class ImageFile(File):
-    def __init__(self, img):
+    def __init__(self, img, info=None):
         super(ImageFile, self).__init__(img)
 
         self.size = None
@@ -88,12 +212,14 @@ class ImageFile(File):
 
         if self.exists:
 
-            with Image(filename=self.path) as wimg:
-                self.size = wimg.size
-                self.resolution = wimg.resolution
-                self.width = wimg.width
-                self.height = wimg.height
-                self.format = wimg.format
+            if info is None:
+                # Read the image header only (no pixel data)
+                info = self.ping_info(self.path)
+
+            self.size = info['size']
+            self.resolution = info['resolution']
+            self.width, self.height = self.size
+            self.format = info['format']
 
             # store orientation
             if self.width > self.height:
@@ -101,6 +227,18 @@ class ImageFile(File):
             else:
                 self.orientation = 'portrait'
 
+    @staticmethod
+    def image_info(wimg, img_format=None):
+        # Metadata of an image already in memory (e.g. a page right after it is written)
+        return {'size': wimg.size,
+                'resolution': wimg.resolution,
+                'format': img_format or wimg.format}
+
+    @classmethod
+    def ping_info(cls, path):
+        with Image.ping(filename=path) as wimg:
+            return cls.image_info(wimg)
+
 
 class PdfFile(File):
     def __init__(self, pdf):
@@ -110,6 +248,9 @@ class PdfFile(File):
         self.page_list = None
         self.read_time = None
         self.write_time = None
+        self.worker_times = None
+        self.cache_hits = None
+        self.cache_misses = None
         self.date = None
         self.valid = False
 
@@ -121,28 +262,158 @@ class PdfFile(File):
             # Make the file valid
             self.valid = True
 
-    def read_pdf(self, res):
+    def read_pdf(self, res, pages=None):
         timer = Timer('PDF Reading')
 
         # Start read timer
         timer.start_timer()
 
-        # Read the PDF file
-        with Image(filename=self.path, resolution=res) as wimg:
+        if pages is None:
+            # Read the PDF file
+            with Image(filename=self.path, resolution=res) as wimg:
+                self.page_list = []
+                # Store pages
+                for i in wimg.sequence:
+                    self.page_list.append(Image(image=i))
+
+            # Store page count
+            self.page_count = len(self.page_list)
+
+        else:
+            # Read only the selected pages (zero-based index, e.g. file.pdf[3])
             self.page_list = []
-            # Store pages
-            for i in wimg.sequence:
-                self.page_list.append(i)
+            for pg in pages:
+                with Image(filename='{}[{}]'.format(self.path, pg - 1), resolution=res) as wimg:
+                    self.page_list.append(Image(image=wimg.sequence[0]))
+
+            # Store page count
+            if self.page_count is None:
+                self.page_count = self.count_pages()
 
         # Stop read timer
         timer.stop_timer()
 
-        # Store page count
-        self.page_count = len(self.page_list)
-
         # Store read time
         self.read_time = timer.get_elapsed()
 
+    def count_pages(self):
+        # Take the page count from the page tree without rendering anything
+        count = self.scan_page_count()
+
+        if count is None:
+            # Page tree is compressed, let ImageMagick ping the document
+            count = self.ping_page_count()
+
+        return count
+
+    def scan_page_count(self):
+        # Follow the trailer /Root to the catalog, then its /Pages to the root of the page tree and take its /Count.
+        # The last definition wins (incremental updates append new ones); None if an object is compressed.
+        with open(self.path, 'rb') as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty file
+                return None
+
+            try:
+                roots = list(_PDF_ROOT.finditer(data))
+                catalog = self.pdf_object(data, *roots[-1].groups()) if roots else None
+                pages = _PDF_PAGES.search(catalog) if catalog else None
+                tree = self.pdf_object(data, *pages.groups()) if pages else None
+                count = _PDF_COUNT.search(tree) if tree else None
+            finally:
+                data.close()
+
+        return int(count.group(1)) if count else None
+
+    @staticmethod
+    def pdf_object(data, num, gen):
+        # Body of the last 'num gen obj ... endobj' definition, None if not found (e.g. in an object stream)
+        starts = list(re.finditer(rb'(?<!\d)' + num + rb'\s+' + gen + rb'\s+obj\b', data))
+        if not starts:
+            return None
+
+        start = starts[-1].end()
+        end = data.find(b'endobj', start)
+
+        return data[start:end if end >= 0 else len(data)]
+
+    def select_pages(self, pages):
+        # Requested pages (1-based) within the document, in ascending order; the others are reported and dropped
+        if self.page_count is None:
+            self.page_count = self.count_pages()
+
+        selected = sorted(set(pg for pg in pages if 0 < pg <= self.page_count))
+        dropped = sorted(set(pages) - set(selected))
+
+        if dropped:
+            self.log.warning('%s: pages out of range (1-%d) skipped: %s', self.filename, self.page_count, dropped)
+            print('Pages out of range (1-{}) skipped: {}'.format(self.page_count, dropped))
+
+        return selected
+
+    def ping_page_count(self):
+        # Read the PDF header only (no pixel data) to take the page count
+        with Image.ping(filename=self.path) as wimg:
+            return len(wimg.sequence)
+
+    def stream_pdf(self, res, window=1, pages=None):
+        """Rasterize the PDF a window of pages at a time.
+
+        Yields (page number, page image) tuples. Only the pages of the current
+        window are held in memory, each page is released once the consumer
+        moves on to the next one. If `pages` is given only those pages (1-based)
+        are decoded, in ascending order.
+        """
+        timer = Timer('PDF Reading')
+
+        # Store page count
+        if self.page_count is None:
+            self.page_count = self.count_pages()
+
+        self.read_time = 0.0
+        window = max(1, int(window))
+
+        if pages is None:
+            selected = range(self.page_count)
+        else:
+            selected = [pg - 1 for pg in self.select_pages(pages)]
+
+        for start, end in self.page_windows(selected, window):
+
+            # Start read timer
+            timer.start_timer()
+
+            # Read only the pages of the current window (zero-based scene range)
+            with Image(filename='{}[{}-{}]'.format(self.path, start, end), resolution=res) as wimg:
+                page_images = [Image(image=i) for i in wimg.sequence]
+
+            # Stop read timer, accumulate read time
+            timer.stop_timer()
+            self.read_time += timer.get_elapsed()
+
+            for offset, page in enumerate(page_images):
+                try:
+                    yield start + offset + 1, page
+                finally:
+                    page.close()
+
+    @staticmethod
+    def page_windows(selected, window):
+        # Group runs of consecutive zero-based page indexes into (start, end) ranges of at most `window` pages
+        start = end = None
+        for i in selected:
+            if start is not None and i == end + 1 and i - start < window:
+                end = i
+                continue
+            if start is not None:
+                yield start, end
+            start = end = i
+
+        if start is not None:
+            yield start, end
+
     def conversion_time(self):
         timer = Timer(str('PDF Conversion [{}]').format(self.filename))
 
@@ -155,6 +426,11 @@ class PdfFile(File):
 
             print('{} Elapsed Time : [{:.3f}s] -- [read: {:.3f}s / write: {:.3f}s]'.format(name, convert_time, self.read_time, self.write_time))
 
+            if self.worker_times:
+                for i, (read_time, write_time) in enumerate(self.worker_times):
+                    print('    worker {:02d} : [{:.3f}s] -- [read: {:.3f}s / write: {:.3f}s]'.format(
+                        i + 1, read_time + write_time, read_time, write_time))
+
             return convert_time
 
         else:
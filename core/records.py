@@ -0,0 +1,211 @@
+
+# *************************************************************************************
+
+# MODULE NAME: records.py
+
+# SYS-REQ: PDFC-SYS-XXX
+
+# SW-REQ: PDFC-SRS-XXX
+
+# MODULE DESCRIPTION: This module provides the compact, immutable records of the converted
+#                     pages and of the comparison results kept for the reports, in place
+#                     of the ImageFile/ImageCompareTask objects.
+
+# REVISION HISTORY:
+#   $Id$
+#   PCR# N/A
+#   Initial Development
+
+# *************************************************************************************
+
+
+from pdfcu.pdfc import ImageFile
+from typing import NamedTuple
+import os
+
+
+class PageRecord(NamedTuple):
+    path: str
+    filename: str
+    page: int
+    format: str
+    resolution: tuple
+    width: int
+    height: int
+    orientation: str
+
+    @classmethod
+    def from_info(cls, path, info, page):
+        # info is the ImageFile metadata dict (size, resolution, format)
+        width, height = info['size']
+        orientation = 'landscape' if width > height else 'portrait'
+
+        return cls(path, os.path.basename(path), page, info['format'], tuple(info['resolution']),
+                   width, height, orientation)
+
+    @classmethod
+    def from_file(cls, path, page):
+        # Metadata read from the file header
+        return cls.from_info(path, ImageFile.ping_info(path), page)
+
+
+class ComparisonRecord(NamedTuple):
+    source_a: str
+    page_a: int
+    source_b: str
+    page_b: int
+    score: float
+    ctype: str
+    valid: bool
+    name: str
+    duration: float
+    date: str
+    image_a_path: str
+    image_b_path: str
+    diff_path: str
+    thres_path: str
+    marks_a_path: str
+    marks_b_path: str
+    fastpath: str
+    cached: bool
+    marks: tuple
+    regions: tuple
+
+    # fields of a difference region (see ImageCompareTask.index_regions)
+    REGION_FIELDS = ('x', 'y', 'w', 'h', 'score', 'marks')
+
+    @classmethod
+    def from_task(cls, task):
+        # Take the result of a finished ImageCompareTask (formatted by the reporters only)
+        score = None if task.score is None else float(task.score)
+        duration = float(task.time)
+
+        # in-memory pages (see compare.PdfCompareTask) may have no image files
+        img_a_path = task.file_a.path if task.file_a is not None else None
+        img_b_path = task.file_b.path if task.file_b is not None else None
+
+        # identical pages (fast path) have no diff/thres/marks images
+        artifacts = task.artifacts
+        if artifacts is None and task.fastpath is None:
+            artifacts = task.artifact_paths()
+
+        if artifacts is not None:
+            diff_path = artifacts['diff']
+            thres_path = artifacts['thres']
+
+            # marks overlays only exist once rendered (ImageCompareTask.render_marks)
+            marks_a_path = artifacts.get('marks_a')
+            marks_b_path = artifacts.get('marks_b')
+        else:
+            diff_path = thres_path = marks_a_path = marks_b_path = None
+
+        # bounding boxes of the differences ((x, y, w, h), ...)
+        marks = None if task.marks is None else tuple(tuple(int(v) for v in m) for m in task.marks)
+
+        # merged difference regions with their scores, most severe first ((x, y, w, h, score, marks), ...)
+        regions = None
+        if task.diff_regions is not None:
+            regions = tuple(tuple(r[f] for f in cls.REGION_FIELDS) for r in task.diff_regions)
+
+        return cls(task.source_a,
+                   task.source_a_pg,
+                   task.source_b,
+                   task.source_b_pg,
+                   score,
+                   task.type,
+                   task.isvalid,
+                   task.name,
+                   duration,
+                   task.date,
+                   img_a_path,
+                   img_b_path,
+                   diff_path,
+                   thres_path,
+                   marks_a_path,
+                   marks_b_path,
+                   task.fastpath,
+                   task.cached,
+                   marks,
+                   regions)
+
+    @classmethod
+    def from_row(cls, row):
+        # Record sent as a JSON list (see distribute.WorkQueue), its marks/regions come back as lists
+        record = cls(*row)
+        marks = None if record.marks is None else tuple(tuple(m) for m in record.marks)
+        regions = None if record.regions is None else tuple(tuple(r) for r in record.regions)
+
+        return record._replace(marks=marks, regions=regions)
+
+    def region_dicts(self):
+        # Regions as written in the reports [{'x': ..., 'score': ..., 'marks': ...}, ...]
+        return None if self.regions is None else [dict(zip(self.REGION_FIELDS, r)) for r in self.regions]
+
+    @classmethod
+    def unmatched(cls, side, source, page, ctype, date, image_path=None):
+        # A page without a counterpart on the other side ('a' or 'b'): invalid, nothing compared
+        name = os.path.basename(image_path).rsplit('.', 1)[0] if image_path else '{}[{}]'.format(source, page)
+
+        source_a, page_a, path_a = (source, page, image_path) if side == 'a' else (None, None, None)
+        source_b, page_b, path_b = (source, page, image_path) if side == 'b' else (None, None, None)
+
+        return cls(source_a, page_a, source_b, page_b, None, ctype, False, name, None, date,
+                   path_a, path_b, None, None, None, None, None, None, None, None)
+
+
+if __name__ == '__main__':
+    # Microbenchmark: construction time and memory of the records vs the objects they replace
+    import sys
+    import shutil
+    import tempfile
+    import timeit
+    import tracemalloc
+    import cv2
+    import numpy as np
+    from pdfcu.compare import ImageCompareTask
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'bench__pg_01.png')
+        cv2.imwrite(path, np.full((64, 48), 255, np.uint8))
+        info = {'size': (48, 64), 'resolution': (320.0, 320.0), 'format': 'PNG'}
+
+        def image_files():
+            return [ImageFile(path, info) for _ in range(n)]
+
+        def page_records():
+            return [PageRecord.from_info(path, info, 1) for _ in range(n)]
+
+        def compare_tasks():
+            tasks = []
+            for i in range(n):
+                task = ImageCompareTask(tmp)
+                task.load_arrays('a', i, None, 'b', i, None)
+                task.score, task.time, task.isvalid, task.fastpath = 1.0, 0.0, True, 'pixels'
+                tasks.append(task)
+            return tasks
+
+        def comparison_records():
+            return [ComparisonRecord.from_task(task) for task in compare_tasks_sample]
+
+        compare_tasks_sample = compare_tasks()
+
+        for label, build in [('ImageFile', image_files),
+                             ('PageRecord', page_records),
+                             ('ImageCompareTask', compare_tasks),
+                             ('ComparisonRecord', comparison_records)]:
+
+            tracemalloc.start()
+            items = build()
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del items
+
+            t = min(timeit.repeat(build, number=1, repeat=3))
+
+            print('{:<18}: {:8.1f} us / {:6.0f} bytes per item'.format(label, 1e6 * t / n, size / n))
+
+    finally:
+        shutil.rmtree(tmp)
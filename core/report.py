@@ -19,11 +19,221 @@
 # *************************************************************************************
 
 
-from pdfcu.pdfc import Folder, Task, PdfFile, ImageFile, Timer
+from pdfcu.pdfc import Folder, Task, PdfFile, Timer
+from pdfcu.records import PageRecord, ComparisonRecord
 import pandas as pd
 from xlsxwriter import Workbook
+from concurrent.futures import ThreadPoolExecutor
+import sqlite3
+import json
+import csv
+import io
 import os
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+def migrate_report_rows(f, path, header, columns):
+    # Report written with other columns (older version): rewrite its rows under the current header, the columns it
+    # did not have are left empty. Unknown columns cannot be mapped, the report is left untouched.
+    unknown = [c for c in header if c not in columns]
+    if unknown:
+        raise ValueError('Report {} has unknown columns: {}'.format(path, ', '.join(unknown)))
+
+    f.seek(0)
+    rows = list(csv.DictReader(f))
+
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, columns, lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(rows)
+
+    f.seek(0)
+    f.truncate()
+    f.write(buf.getvalue())
+
+
+def append_report_rows(path, columns, rows):
+    # Format the rows (and the header for a new report) in memory first
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    writer.writerows(rows)
+
+    with open(path, 'a+', newline='') as f:
+        # Lock the report so concurrent sessions/workers append whole rows one after the other
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            # lock the first byte (writes in append mode still go to the end)
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+        try:
+            # the existing header must match the rows appended
+            f.seek(0)
+            header = next(csv.reader([f.readline()]), None)
+
+            if not header:
+                f.write(','.join(columns) + '\n')
+            elif header != list(columns):
+                migrate_report_rows(f, path, header, list(columns))
+
+            # single buffered append
+            f.write(buf.getvalue())
+            f.flush()
+
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def json_fields(record: ComparisonRecord):
+    # The marks/regions of a comparison record as the JSON text of the reports
+    marks = None if record.marks is None else json.dumps([list(m) for m in record.marks])
+    regions = None if record.regions is None else json.dumps(record.region_dicts())
+
+    return record._replace(marks=marks, regions=regions)
+
+
+class SessionDatabase:
+
+    FILENAME = '_session.sqlite'
+
+    # typed columns of the conversion/comparison reports
+    CONVERSION_COLUMNS = [('source', 'TEXT'),
+                          ('page', 'INTEGER'),
+                          ('filename', 'TEXT'),
+                          ('format', 'TEXT'),
+                          ('resolution', 'REAL'),
+                          ('orientation', 'TEXT'),
+                          ('width', 'INTEGER'),
+                          ('height', 'INTEGER'),
+                          ('totalpage', 'INTEGER'),
+                          ('date', 'TEXT'),
+                          ('fpath', 'TEXT'),
+                          ('srcpath', 'TEXT')]
+
+    COMPARISON_COLUMNS = [('source_a', 'TEXT'),
+                          ('page_a', 'INTEGER'),
+                          ('source_b', 'TEXT'),
+                          ('page_b', 'INTEGER'),
+                          ('score', 'REAL'),
+                          ('ctype', 'TEXT'),
+                          ('valid', 'INTEGER'),
+                          ('name', 'TEXT'),
+                          ('duration', 'REAL'),
+                          ('date', 'TEXT'),
+                          ('image_a_path', 'TEXT'),
+                          ('image_b_path', 'TEXT'),
+                          ('diff_path', 'TEXT'),
+                          ('thres_path', 'TEXT'),
+                          ('marks_a_path', 'TEXT'),
+                          ('marks_b_path', 'TEXT'),
+                          ('fastpath', 'TEXT'),
+                          ('cached', 'INTEGER'),
+                          ('marks', 'TEXT'),
+                          ('regions', 'TEXT')]
+
+    # conversion banner (one row per converted source)
+    RUN_COLUMNS = [('source', 'TEXT PRIMARY KEY'),
+                   ('srcpath', 'TEXT'),
+                   ('totalpage', 'INTEGER'),
+                   ('date', 'TEXT'),
+                   ('read_time', 'REAL'),
+                   ('write_time', 'REAL'),
+                   ('cache_hits', 'INTEGER'),
+                   ('cache_misses', 'INTEGER')]
+
+    def __init__(self, folder):
+        self.file = os.path.join(folder, self.FILENAME)
+
+    @staticmethod
+    def table_sql(table, columns):
+        return 'CREATE TABLE IF NOT EXISTS {} ({})'.format(table, ', '.join('{} {}'.format(*c) for c in columns))
+
+    def connect(self):
+        # WAL lets the gleaner read while workers are still writing
+        con = sqlite3.connect(self.file, timeout=60)
+        con.execute('PRAGMA journal_mode=WAL')
+
+        con.execute(self.table_sql('conversions', self.CONVERSION_COLUMNS))
+        con.execute(self.table_sql('comparisons', self.COMPARISON_COLUMNS))
+        con.execute(self.table_sql('conversion_runs', self.RUN_COLUMNS))
+
+        # indexed lookups by source and page
+        con.execute('CREATE INDEX IF NOT EXISTS conversions_source_page ON conversions (source, page)')
+        con.execute('CREATE INDEX IF NOT EXISTS comparisons_a ON comparisons (source_a, page_a)')
+        con.execute('CREATE INDEX IF NOT EXISTS comparisons_b ON comparisons (source_b, page_b)')
+
+        return con
+
+    @staticmethod
+    def insert_sql(table, columns):
+        return 'INSERT INTO {} VALUES ({})'.format(table, ', '.join('?' * len(columns)))
+
+    def replace_conversion(self, source: PdfFile, rows: list):
+        con = self.connect()
+        try:
+            with con:
+                con.execute('DELETE FROM conversions WHERE source = ?', (source.filename,))
+                con.executemany(self.insert_sql('conversions', self.CONVERSION_COLUMNS), rows)
+                con.execute('INSERT OR REPLACE INTO conversion_runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            (source.filename, source.path, source.page_count, source.date,
+                             source.read_time, source.write_time, source.cache_hits, source.cache_misses))
+        finally:
+            con.close()
+
+    def insert_comparisons(self, rows: list):
+        con = self.connect()
+        try:
+            with con:
+                con.executemany(self.insert_sql('comparisons', self.COMPARISON_COLUMNS),
+                                [[self.as_sql(v) for v in json_fields(record)] for record in rows])
+        finally:
+            con.close()
+
+    @staticmethod
+    def as_sql(value):
+        # sqlite has no boolean/numpy types
+        if isinstance(value, bool):
+            return int(value)
+        if hasattr(value, 'item'):
+            return value.item()
+        return value
+
+    def read_conversions(self, source=None, page=None):
+        return self.query('conversions', 'source', 'page', source, page)
+
+    def read_comparisons(self, source=None, page=None):
+        return self.query('comparisons', 'source_a', 'page_a', source, page)
+
+    def query(self, table, source_col, page_col, source=None, page=None):
+        sql = 'SELECT * FROM {}'.format(table)
+        where = []
+        params = []
+
+        if source is not None:
+            where.append('{} = ?'.format(source_col))
+            params.append(source)
+        if page is not None:
+            where.append('{} = ?'.format(page_col))
+            params.append(page)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+
+        con = self.connect()
+        try:
+            return pd.read_sql_query(sql, con, params=params)
+        finally:
+            con.close()
+
 
 class ReportTask(Task):
 
@@ -35,11 +245,25 @@ class ReportTask(Task):
 
 
 class PdfConversionReporter(ReportTask):
-    def __init__(self, report_dir, source: PdfFile, image_list: [ImageFile]):
+    def __init__(self, report_dir, source: PdfFile, image_list: [PageRecord], backend='csv'):
         super(PdfConversionReporter, self).__init__(report_dir)
 
         self.source = source
         self.image_pages = image_list
+        self.backend = backend
+
+        self.columns = ['source',
+                        'page',
+                        'filename',
+                        'format',
+                        'resolution',
+                        'orientation',
+                        'width',
+                        'height',
+                        'totalpage',
+                        'date',
+                        'fpath',
+                        'srcpath']
 
         # create data frame object
         self.df = pd.DataFrame(columns=None)
@@ -48,6 +272,12 @@ class PdfConversionReporter(ReportTask):
 
     def create_report(self):
 
+        if self.backend == 'sqlite':
+            # replace the rows of this source in the session database
+            db = SessionDatabase(self.folder.path)
+            db.replace_conversion(self.source, self.report_rows())
+            return
+
         # Look for pre-existing report file
         if not os.path.isfile(self.file):
             # add a new report
@@ -59,12 +289,21 @@ class PdfConversionReporter(ReportTask):
             # create a new report
             self.add_report()
 
+        # create data frame
+        self.df = pd.DataFrame(self.report_rows(), columns=self.columns)
+
+        # save report
+        with open(self.file, 'a') as f:
+            self.df.to_csv(f, index=False)
+
+    def report_rows(self):
+
         # gather information
         image_info_list = []
 
         for img in self.image_pages:
             source = self.source.filename
-            page = int(img.filename.split(str(img.format).lower())[0].split('.')[0].split('_')[-1])
+            page = img.page
             filename = img.filename
 
             fmt = img.format
@@ -93,25 +332,7 @@ class PdfConversionReporter(ReportTask):
 
             image_info_list.append(element)
 
-        # create data frame
-        cols = ['source',
-                'page',
-                'filename',
-                'format',
-                'resolution',
-                'orientation',
-                'width',
-                'height',
-                'totalpage',
-                'date',
-                'fpath',
-                'srcpath']
-
-        self.df = pd.DataFrame(image_info_list, columns=cols)
-
-        # save report
-        with open(self.file, 'a') as f:
-            self.df.to_csv(f, index=False)
+        return image_info_list
 
     def add_report(self):
         # create a new report file
@@ -125,6 +346,12 @@ class PdfConversionReporter(ReportTask):
         f.write('\n# date         : {}'.format(self.source.date))
         f.write('\n# convert time : {:.3f}s -- '.format(self.source.read_time + self.source.write_time))
         f.write('[read: {:.3f}s | write: {:.3f}s]'.format(self.source.read_time, self.source.write_time))
+        if self.source.worker_times:
+            for i, (read_time, write_time) in enumerate(self.source.worker_times):
+                f.write('\n# worker {:02d}    : {:.3f}s -- '.format(i + 1, read_time + write_time))
+                f.write('[read: {:.3f}s | write: {:.3f}s]'.format(read_time, write_time))
+        if self.source.cache_hits is not None:
+            f.write('\n# page cache   : {} hits | {} misses'.format(self.source.cache_hits, self.source.cache_misses))
         f.write('\n#')
         f.write('\n#')
         f.write('*' * 120)
@@ -141,104 +368,49 @@ class PdfConversionReporter(ReportTask):
 
 
 class ImageComparisonReporter(ReportTask):
-    def __init__(self, report_dir, compare_task):
+
+    COLUMNS = list(ComparisonRecord._fields)
+
+    def __init__(self, report_dir, compare_task=None, backend='csv'):
 
         self.compare_task = compare_task
+        self.backend = backend
 
         super(ImageComparisonReporter, self).__init__(report_dir)
 
-        self.columns = ['source_a',
-                        'page_a',
-                        'source_b',
-                        'page_b',
-                        'score',
-                        'ctype',
-                        'valid',
-                        'name',
-                        'duration',
-                        'date',
-                        'image_a_path',
-                        'image_b_path',
-                        'diff_path',
-                        'thres_path',
-                        'marks_a_path',
-                        'marks_b_path']
-
-        self.df = pd.DataFrame(columns=self.columns)
+        self.columns = list(self.COLUMNS)
 
         self.file = os.path.join(report_dir, '_comparison.report')
 
     def create_report(self):
-        # Look for pre-existing report file
-        if not os.path.isfile(self.file):
-            # add a new report
-            f = open(self.file, 'a')
+        # append the row of the current comparison
+        self.create_batch_report([self.report_row()])
 
-            # initialize the file data
-            self.df.to_csv(f, index=None)
+    def create_batch_report(self, rows: list):
+        if self.backend == 'sqlite':
+            SessionDatabase(self.folder.path).insert_comparisons(rows)
+            return
 
-            # close the file
-            f.close()
+        # append all the new rows at once, the existing rows are never re-read
+        append_report_rows(self.file, self.columns, [self.format_row(record) for record in rows])
 
-        else:
-            # read the report
-            self.df = pd.read_csv(self.file)
-
-            self.df['score'] = self.df['score'].map('{:.05f}'.format)
-            self.df['duration'] = self.df['duration'].map('{:.05f}'.format)
-
-        # create new info data
-        src_a = self.compare_task.source_a
-        pg_a = self.compare_task.source_a_pg
-        src_b = self.compare_task.source_b
-        pg_b = self.compare_task.source_b_pg
-
-        valid = self.compare_task.isvalid
-        score = str('{:.05f}').format(self.compare_task.score)
-        ctype = self.compare_task.type
-
-        name = self.compare_task.name
-        duration = str('{:.05f}').format(self.compare_task.time)
-        date = self.compare_task.date
-
-        img_a_path = self.compare_task.file_a.path
-        img_b_path = self.compare_task.file_b.path
-
-        diff_path = self.compare_task.diffpath()
-        thres_path = self.compare_task.threspath()
-        marks = self.compare_task.markspath()
-        marks_a_path = marks[0]
-        marks_b_path = marks[1]
-
-        new_data = [src_a,
-                    pg_a,
-                    src_b,
-                    pg_b,
-                    score,
-                    ctype,
-                    valid,
-                    name,
-                    duration,
-                    date,
-                    img_a_path,
-                    img_b_path,
-                    diff_path,
-                    thres_path,
-                    marks_a_path,
-                    marks_b_path]
-
-        new_df = pd.DataFrame([new_data], columns=self.columns)
-
-        # append new report
-        self.df = pd.DataFrame(pd.concat([self.df, new_df], ignore_index=True))
+    @staticmethod
+    def format_row(record: ComparisonRecord):
+        # Report row of a record: score/duration in fixed point, marks/regions as JSON
+        record = json_fields(record)
+        score = None if record.score is None else '{:.05f}'.format(record.score)
+        duration = None if record.duration is None else '{:.05f}'.format(record.duration)
 
-        # save report
-        self.df.to_csv(self.file, index=None)
+        return list(record._replace(score=score, duration=duration))
+
+    def report_row(self):
+        # record of the current comparison
+        return ComparisonRecord.from_task(self.compare_task)
 
 
 class ReportGleaner(ReportTask):
 
-    def __init__(self, report_name, src_folder, dest_folder):
+    def __init__(self, report_name, src_folder, dest_folder, incremental=False, threads=None):
         super(ReportGleaner, self).__init__(src_folder)
 
         Folder(dest_folder)
@@ -250,68 +422,179 @@ class ReportGleaner(ReportTask):
         self.writer = None
         self.workbook = None
 
-    def scan_conversions(self, folder):
+        # session databases found while scanning (sqlite report backend)
+        self.databases = []
+
+        # parsed reports of the last gleaning, re-read only when their mtime changed
+        self.incremental = incremental
+        self.state_file = os.path.abspath(os.path.join(dest_folder, '.{}.glean'.format(report_name)))
+        self.threads = threads
+
+    @staticmethod
+    def find_reports(folder):
+        # Single scandir walk collecting every report type: [(kind, path, mtime)]
+        reports = []
+        stack = [folder]
+
+        while stack:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name == '_conversion.report':
+                        reports.append(('conversion', entry.path, entry.stat().st_mtime))
+                    elif entry.name == '_comparison.report':
+                        reports.append(('comparison', entry.path, entry.stat().st_mtime))
+                    elif entry.name == SessionDatabase.FILENAME:
+                        # pending writes live in the write-ahead log
+                        wal = entry.path + '-wal'
+                        mtime = max(entry.stat().st_mtime, os.path.getmtime(wal) if os.path.isfile(wal) else 0)
+                        reports.append(('database', entry.path, mtime))
+
+        return sorted(reports, key=lambda r: r[1])
+
+    @staticmethod
+    def read_report(kind, path):
+        # Parse one report file into (conversion frame, comparison frame)
+        if kind == 'conversion':
+            return pd.read_csv(path, comment='#'), None
+
+        if kind == 'comparison':
+            return None, pd.read_csv(path)
+
+        db = SessionDatabase(os.path.dirname(path))
+        comp = db.read_comparisons()
+        comp['valid'] = comp['valid'].astype(bool)
+        return db.read_conversions(), comp
+
+    def glean(self, folder, kinds=('conversion', 'comparison', 'database')):
+
+        found = self.find_reports(folder)
+        reports = [r for r in found if r[0] in kinds]
+
+        # reuse the frames of unchanged reports from the last gleaning
+        state = {}
+        if self.incremental and os.path.isfile(self.state_file):
+            state = pd.read_pickle(self.state_file)
+
+        frames = {}
+        todo = []
+        for kind, path, mtime in reports:
+            if path in state and state[path][0] == mtime:
+                frames[path] = state[path][1]
+            else:
+                todo.append((kind, path, mtime))
+
+        # parse the new/changed reports in parallel (I/O and C parser bound)
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            parsed = pool.map(lambda r: self.read_report(r[0], r[1]), todo)
+            for (kind, path, mtime), result in zip(todo, parsed):
+                frames[path] = result
+                state[path] = (mtime, result)
+
+        if self.incremental:
+            # forget the reports of the folder that disappeared, the other kinds/folders are kept for the next scans
+            found = set(r[1] for r in found)
+            pd.to_pickle({p: v for p, v in state.items() if p in found or not self.is_inside(p, folder)},
+                         self.state_file)
+
+        self.databases = [SessionDatabase(os.path.dirname(r[1])) for r in reports if r[0] == 'database']
+
+        # concatenate once
+        conv = [frames[r[1]][0] for r in reports if frames[r[1]][0] is not None]
+        comp = [frames[r[1]][1] for r in reports if frames[r[1]][1] is not None]
+
+        return (pd.concat(conv, ignore_index=True) if conv else pd.DataFrame(),
+                pd.concat(comp, ignore_index=True) if comp else pd.DataFrame())
+
+    @staticmethod
+    def is_inside(path, folder):
+        try:
+            return not os.path.relpath(path, folder).startswith(os.pardir)
+        except ValueError:
+            # other drive
+            return False
 
-        result = []
-        for root, dirs, files in os.walk(folder):
-            for name in files:
-                if name == '_conversion.report':
-                    result.append(os.path.join(root, name))
+    def scan_conversions(self, folder):
 
-        for p in result:
-            df = pd.read_csv(p, comment='#')
-            self.conv_df = pd.DataFrame(pd.concat([self.conv_df, df], ignore_index=True))
+        self.conv_df = self.glean(folder, ('conversion', 'database'))[0]
 
         # self.conv_df.to_csv(os.path.join(self.folder.path, '_all_conversions.report'), index=False)
 
     def scan_comparisons(self, folder):
 
-        result = []
-        for root, dirs, files in os.walk(folder):
-            for name in files:
-                if name == '_comparison.report':
-                    result.append(os.path.join(root, name))
-
-        for p in result:
-            df = pd.read_csv(p)
-            self.comp_df = pd.DataFrame(pd.concat([self.comp_df, df], ignore_index=True))
+        self.comp_df = self.glean(folder, ('comparison', 'database'))[1]
 
         # self.comp_df.to_csv(os.path.join(self.folder.path, '_all_comparisons.report'), index=False)
 
+    def lookup_conversions(self, source, page=None):
+        # indexed lookup over the session databases
+        dfs = [db.read_conversions(source, page) for db in self.databases]
+        return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+
+    def lookup_comparisons(self, source, page=None):
+        dfs = [db.read_comparisons(source, page) for db in self.databases]
+        return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+
     def scan_reports(self):
-        self.scan_conversions(self.folder.path)
-        self.scan_comparisons(self.folder.path)
+        # both report types from one walk of the tree
+        self.conv_df, self.comp_df = self.glean(self.folder.path)
+
+    @staticmethod
+    def write_frame(ws, df, head_fmt, col_formats=None, chunk_rows=10000):
+        # Stream a data frame into a worksheet (row order, constant memory) and size its columns
+
+        cols = list(df)
+        col_formats = col_formats or {}
+
+        # headers and auto filter
+        ws.write_row(0, 0, cols, head_fmt)
+        if cols:
+            ws.autofilter(0, 0, 0, len(cols) - 1)
+
+        # column widths computed from the data (no Excel automation needed), set before any row is
+        # written so the column formats also apply to the streamed cells
+        widths = [len(str(c)) for c in cols]
+        for start in range(0, len(df), chunk_rows):
+            chunk = df.iloc[start:start + chunk_rows]
+            for j, c in enumerate(cols):
+                lengths = chunk[c].dropna().astype(str).str.len()
+                if len(lengths):
+                    widths[j] = max(widths[j], int(lengths.max()))
+
+        for j, width in enumerate(widths):
+            ws.set_column(j, j, min(width + 2, 255), col_formats.get(j))
+
+        for start in range(0, len(df), chunk_rows):
+            chunk = df.iloc[start:start + chunk_rows]
+
+            # plain python values taken column-wise from the underlying arrays (NaN -> blank cell)
+            columns = [chunk[c].astype(object).where(chunk[c].notna(), None).to_numpy() for c in cols]
+
+            for i, row in enumerate(zip(*columns)):
+                ws.write_row(start + i + 1, 0, row)
 
     def gather_reports(self):
 
         def_fmt_prop = {'font': 'Consolas', 'font_size': 9, 'align': 'center', 'valign': 'center'}
-        self.workbook = Workbook(self.file, options={'default_format_properties': def_fmt_prop})
+        self.workbook = Workbook(self.file, options={'default_format_properties': def_fmt_prop,
+                                                     'constant_memory': True})
 
         # formats
         rawhead_fmt = self.workbook.add_format({'bold': True, 'align': 'center', 'valign': 'center'})
 
-        # worksheets
+        # worksheets (in their final order)
+        self.workbook.add_worksheet('summary')
         convert_ws = self.workbook.add_worksheet('_convert_raw')
         compare_ws = self.workbook.add_worksheet('_compare_raw')
 
-        # headers for raw data sheets
-        convert_ws.write_row(0, 0, list(self.conv_df), rawhead_fmt)
-        compare_ws.write_row(0, 0, list(self.comp_df), rawhead_fmt)
-
-        # add auto filter on headers
-        convert_ws.autofilter(0, 0, 0, len(self.conv_df.columns) - 1)
-        compare_ws.autofilter(0, 0, 0, len(self.comp_df.columns) - 1)
-
         # populate raw data sheets
-        for i in range(len(self.conv_df)):
-            convert_ws.write_row('A{}'.format(i+2), self.conv_df.iloc[i])
-
-        for i in range(len(self.comp_df)):
-            compare_ws.write_row('A{}'.format(i+2), self.comp_df.iloc[i])
+        self.write_frame(convert_ws, self.conv_df, rawhead_fmt)
+        self.write_frame(compare_ws, self.comp_df, rawhead_fmt)
 
     def summary_report(self):
 
-        summary_ws = self.workbook.add_worksheet('summary')
+        summary_ws = self.workbook.get_worksheet_by_name('summary')
 
         # formats
         head_fmt = self.workbook.add_format({'bold': True, 'align': 'center', 'valign': 'center'})
@@ -320,53 +603,12 @@ class ReportGleaner(ReportTask):
         # populate the summary sheet
         df = self.comp_df[['source_a', 'page_a', 'source_b', 'page_b', 'score', 'ctype', 'valid', 'name']]
 
-        # headers for summary sheet
-        summary_ws.write_row(0, 0, list(df), head_fmt)
-
-        # populate summary sheet
-        for i in range(len(df)):
-            summary_ws.write_row('A{}'.format(i + 2), df.iloc[i])
-
-        # set number format
-        summary_ws.set_column(4, 4, cell_format=percent_fmt)
-
-        # add auto filter on headers
-        summary_ws.autofilter(0, 0, 0, len(df.columns) - 1)
-
-        # arrange the worksheets
-        sheetlist = ['summary', '_convert_raw', '_compare_raw']
-        self.workbook.worksheets_objs.sort(key=lambda x: sheetlist.index(x.name))
-
-        sheet_count = len(self.workbook.worksheets_objs)
+        # populate summary sheet (score in percent format)
+        self.write_frame(summary_ws, df, head_fmt, {4: percent_fmt})
 
         # close workbook
         self.workbook.close()
 
-        # autofit columns
-        self.autofit_columns(sheet_count)
-
-    def autofit_columns(self, sheet_count):
-
-        from win32com.client import Dispatch
-
-        excel = Dispatch('Excel.Application')
-        wb = excel.Workbooks.Open(self.file)
-
-        # activate second sheet
-        for i in range(sheet_count):
-            excel.Worksheets(i+1).Activate()
-
-            # autofit column in active sheet
-            excel.ActiveSheet.Columns.AutoFit()
-
-        # activate the first sheet
-        excel.Worksheets(1).Activate()
-
-        # save changes in a current file
-        wb.Save()
-
-        wb.Close()
-
     def create_report(self):
 
         # scan existing report files
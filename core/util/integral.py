@@ -0,0 +1,123 @@
+"""
+The integral module computes box-filtered (windowed mean) image moments from
+summed-area tables, at a constant cost per pixel whatever the window size.
+"""
+from __future__ import division
+
+import numpy as np
+
+
+__all__ = ['integral_moments']
+
+
+def _accumulator_type(dtype, win_size):
+    # Integer images are summed exactly. The tables may wrap around, the window
+    # sums (four-corner differences) stay exact as long as they fit the type.
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'b' or (dtype.kind == 'u' and dtype.itemsize == 1):
+        if 255 ** 2 * win_size ** 2 < 2 ** 32:
+            return np.uint32
+        return np.uint64
+    if dtype.kind in 'iu' and dtype.itemsize <= 2:
+        return np.int64
+    return np.float64
+
+
+def integral_moments(X, Y, win_size, dtype=np.float64):
+    """Compute the windowed means of X, Y, X*X, Y*Y and X*Y.
+
+    Parameters
+    ----------
+    X, Y : ndarray
+        2-D images of the same shape.
+    win_size : int
+        The side-length of the (odd) square window.
+    dtype : {np.float64, np.float32}, optional
+        Floating point type of the returned moments.
+
+    Returns
+    -------
+    ux, uy, uxx, uyy, uxy : ndarray
+        The five windowed moments, equal to `scipy.ndimage.uniform_filter`
+        (mode='reflect') applied to each of the products.
+
+    Notes
+    -----
+    The images are padded once by the window radius (mirrored like the
+    'reflect' mode of ndimage) plus a leading row and column of zeros, and
+    each product is summed in place into a single reused summed-area table,
+    so a window sum costs four lookups. 8 and 16-bit images are accumulated
+    in (modular) integer arithmetic, which is exact and avoids the
+    cancellation of the floating point variance terms.
+    """
+    if X.ndim != 2 or X.shape != Y.shape:
+        raise ValueError('Input images must be 2-D and have the same dimensions.')
+
+    if not (win_size % 2 == 1):
+        raise ValueError('Window size must be odd.')
+
+    acc = _accumulator_type(X.dtype, win_size)
+    r = win_size // 2
+    H, W = X.shape
+    NP = win_size ** 2
+
+    # pad once, mirroring the edges like ndimage 'reflect', behind a zero row/column
+    Xp = np.zeros((H + 2 * r + 1, W + 2 * r + 1), dtype=acc)
+    Yp = np.zeros_like(Xp)
+    Xp[1:, 1:] = np.pad(X, r, mode='symmetric')
+    Yp[1:, 1:] = np.pad(Y, r, mode='symmetric')
+
+    # summed-area table, rebuilt in place for every product
+    sat = np.empty_like(Xp)
+    box = np.empty((H, W), dtype=acc)
+
+    moments = []
+    for a, b in ((Xp, None), (Yp, None), (Xp, Xp), (Yp, Yp), (Xp, Yp)):
+        if b is None:
+            np.copyto(sat, a)
+        else:
+            np.multiply(a, b, out=sat)
+
+        np.cumsum(sat, axis=1, out=sat)
+        np.cumsum(sat, axis=0, out=sat)
+
+        # window sum from the four corners of the table
+        np.subtract(sat[win_size:, win_size:], sat[:H, win_size:], out=box)
+        box -= sat[win_size:, :W]
+        box += sat[:H, :W]
+
+        m = box.astype(dtype)
+        m /= NP
+        moments.append(m)
+
+    return tuple(moments)
+
+
+if __name__ == '__main__':
+    # Benchmark against the uniform_filter path at the usual page sizes
+    # python -m pdfcu.util.integral
+    import time
+    from scipy.ndimage import uniform_filter
+
+    def uniform_moments(X, Y, win_size, dtype=np.float64):
+        X = X.astype(dtype)
+        Y = Y.astype(dtype)
+        return tuple(uniform_filter(p, size=win_size) for p in (X, Y, X * X, Y * Y, X * Y))
+
+    rng = np.random.RandomState(0)
+    pages = [('A4 @ 150dpi', (1754, 1240)),
+             ('A4 @ 320dpi', (3742, 2646)),
+             ('A3 @ 320dpi', (5292, 3742))]
+
+    for name, shape in pages:
+        X = rng.randint(0, 256, shape).astype(np.uint8)
+        Y = rng.randint(0, 256, shape).astype(np.uint8)
+
+        for win_size in (7, 15, 31):
+            timings = []
+            for func in (uniform_moments, integral_moments):
+                start = time.time()
+                func(X, Y, win_size)
+                timings.append(time.time() - start)
+
+            print('{:12s} win {:2d} :: uniform_filter: {:.3f}s / integral: {:.3f}s'.format(name, win_size, *timings))
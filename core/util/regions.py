@@ -0,0 +1,119 @@
+"""
+The regions module merges the bounding boxes of the differences between two
+images into difference regions and scores each region from the SSIM map.
+"""
+from __future__ import division
+
+import numpy as np
+
+
+__all__ = ['merge_boxes', 'region_scores']
+
+
+def _find(parent, i):
+    # Root of i, with path halving
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def _merge_pass(boxes, gap, cell):
+    # One pass of grid indexed merging, returns the bounding boxes of the groups
+    n = len(boxes)
+    parent = list(range(n))
+    grid = {}
+
+    for i, (x0, y0, x1, y1) in enumerate(boxes):
+        # cells covered by the box grown by the gap
+        cx0, cy0 = int(x0 - gap) // cell, int(y0 - gap) // cell
+        cx1, cy1 = int(x1 + gap) // cell, int(y1 + gap) // cell
+
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                members = grid.setdefault((cx, cy), [])
+
+                for j in members:
+                    bx0, by0, bx1, by1 = boxes[j]
+                    if x0 <= bx1 + gap and bx0 <= x1 + gap and y0 <= by1 + gap and by0 <= y1 + gap:
+                        ri, rj = _find(parent, i), _find(parent, j)
+                        if ri != rj:
+                            parent[ri] = rj
+
+                members.append(i)
+
+    groups = {}
+    for i, (x0, y0, x1, y1) in enumerate(boxes):
+        r = _find(parent, i)
+        if r in groups:
+            gx0, gy0, gx1, gy1 = groups[r]
+            groups[r] = (min(gx0, x0), min(gy0, y0), max(gx1, x1), max(gy1, y1))
+        else:
+            groups[r] = (x0, y0, x1, y1)
+
+    return list(groups.values())
+
+
+def merge_boxes(boxes, gap=16, cell=64):
+    """Merge overlapping or nearby bounding boxes into regions.
+
+    Parameters
+    ----------
+    boxes : sequence of (x, y, w, h)
+        Bounding boxes, e.g. of the contours of a thresholded difference.
+    gap : int, optional
+        Boxes at most `gap` pixels apart (horizontally and vertically) are
+        merged, touching boxes are 0 pixels apart.
+    cell : int, optional
+        Cell size in pixels of the grid used to index the boxes.
+
+    Returns
+    -------
+    regions : list of (x, y, w, h)
+        The merged boxes, sorted top to bottom then left to right.
+
+    Notes
+    -----
+    Each box is only tested against the boxes sharing a grid cell with it,
+    and grouped with a union-find. A merged box may reach boxes that its
+    parts did not, so the passes are repeated until nothing merges anymore.
+    """
+    merged = [(x, y, x + w, y + h) for (x, y, w, h) in boxes]
+
+    while True:
+        count = len(merged)
+        merged = _merge_pass(merged, gap, max(int(cell), 1))
+        if len(merged) == count:
+            break
+
+    return [(x0, y0, x1 - x0, y1 - y0) for (x0, y0, x1, y1) in sorted(merged, key=lambda b: (b[1], b[0]))]
+
+
+def region_scores(S, regions):
+    """Mean of the SSIM map within each region.
+
+    Parameters
+    ----------
+    S : ndarray
+        2-D SSIM map (e.g. the `full` output of `compare_ssim`).
+    regions : sequence of (x, y, w, h)
+        Regions of the map.
+
+    Returns
+    -------
+    scores : ndarray
+        The mean SSIM of each region (float64).
+
+    Notes
+    -----
+    Each region is averaged over its own slice of the map, nothing the size
+    of the whole map is allocated (`S` may be a memory-mapped array, see
+    `compare_ssim_tiled`).
+    """
+    scores = np.empty(len(regions), dtype=np.float64)
+
+    for i, (x, y, w, h) in enumerate(regions):
+        # empty regions take the value at their corner
+        scores[i] = S[y:y + max(int(h), 1), x:x + max(int(w), 1)].mean(dtype=np.float64)
+
+    return scores
@@ -2,11 +2,14 @@ from __future__ import division
 
 import numpy as np
 from scipy.ndimage import uniform_filter, gaussian_filter
+from scipy.ndimage import binary_dilation, label, find_objects
 
 from .dtype import dtype_range
 from .arraycrop import crop
+from .integral import integral_moments
 
-__all__ = ['compare_ssim']
+__all__ = ['compare_ssim', 'compare_ssim_tiled', 'compare_ssim_pyramid',
+           'compare_ssim_batch', 'ssim_batch_size']
 
 
 def compare_ssim(X, Y, win_size=None, gradient=False,
@@ -49,6 +52,20 @@ def compare_ssim(X, Y, win_size=None, gradient=False,
         algorithm parameter, K2 (small constant, see [1]_)
     sigma : float
         sigma for the Gaussian when `gaussian_weights` is True.
+    dtype : {np.float64, np.float32}
+        Floating point type of the filtered moments and of the returned maps.
+        float32 halves the memory of every intermediate; for 8-bit images the
+        mean SSIM stays within 1e-4 and the SSIM map within 1e-3 of the
+        float64 result.
+    reuse_buffers : bool
+        If True (and `gradient` is False), compute the SSIM map in place over
+        the filtered moment buffers instead of allocating a new array for
+        every intermediate term.
+    engine : {'filter', 'integral'}
+        How the windowed moments are computed when `gaussian_weights` is
+        False. 'filter' runs `scipy.ndimage.uniform_filter` over each of the
+        five products, 'integral' takes all five from summed-area tables
+        (2-D images only), exact for 8 and 16-bit images.
 
     Returns
     -------
@@ -131,6 +148,15 @@ def compare_ssim(X, Y, win_size=None, gradient=False,
     if sigma < 0:
         raise ValueError("sigma must be positive")
     use_sample_covariance = kwargs.pop('use_sample_covariance', True)
+    dtype = np.dtype(kwargs.pop('dtype', np.float64))
+    reuse_buffers = kwargs.pop('reuse_buffers', False)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError("dtype must be float32 or float64")
+    engine = kwargs.pop('engine', 'filter')
+    if engine not in ('filter', 'integral'):
+        raise ValueError("engine must be 'filter' or 'integral'")
+    if engine == 'integral' and gaussian_weights:
+        raise ValueError("The integral engine only supports uniform weights")
 
     if win_size is None:
         if gaussian_weights:
@@ -162,9 +188,15 @@ def compare_ssim(X, Y, win_size=None, gradient=False,
         filter_func = uniform_filter
         filter_args = {'size': win_size}
 
+    if engine == 'integral':
+        # windowed means of X, Y, X*X, Y*Y and X*Y
+        moments = integral_moments(X, Y, win_size, dtype)
+    else:
+        moments = None
+
     # ndimage filters need floating point data
-    X = X.astype(np.float64)
-    Y = Y.astype(np.float64)
+    X = X.astype(dtype)
+    Y = Y.astype(dtype)
 
     NP = win_size ** ndim
 
@@ -174,22 +206,39 @@ def compare_ssim(X, Y, win_size=None, gradient=False,
     else:
         cov_norm = 1.0  # population covariance to match Wang et. al. 2004
 
-    # compute (weighted) means
-    ux = filter_func(X, **filter_args)
-    uy = filter_func(Y, **filter_args)
+    R = data_range
+    C1 = (K1 * R) ** 2
+    C2 = (K2 * R) ** 2
+
+    # to avoid edge effects will ignore filter radius strip around edges
+    pad = (win_size - 1) // 2
+
+    if reuse_buffers and not gradient:
+        S = _ssim_inplace(X, Y, filter_func, filter_args, cov_norm, C1, C2, moments)
+        mssim = crop(S, pad).mean(dtype=np.float64)
+
+        if full:
+            return mssim, S
+        else:
+            return mssim
+
+    if moments is not None:
+        ux, uy, uxx, uyy, uxy = moments
+    else:
+        # compute (weighted) means
+        ux = filter_func(X, **filter_args)
+        uy = filter_func(Y, **filter_args)
+
+        # compute (weighted) second moments
+        uxx = filter_func(X * X, **filter_args)
+        uyy = filter_func(Y * Y, **filter_args)
+        uxy = filter_func(X * Y, **filter_args)
 
     # compute (weighted) variances and covariances
-    uxx = filter_func(X * X, **filter_args)
-    uyy = filter_func(Y * Y, **filter_args)
-    uxy = filter_func(X * Y, **filter_args)
     vx = cov_norm * (uxx - ux * ux)
     vy = cov_norm * (uyy - uy * uy)
     vxy = cov_norm * (uxy - ux * uy)
 
-    R = data_range
-    C1 = (K1 * R) ** 2
-    C2 = (K2 * R) ** 2
-
     A1, A2, B1, B2 = ((2 * ux * uy + C1,
                        2 * vxy + C2,
                        ux ** 2 + uy ** 2 + C1,
@@ -197,11 +246,8 @@ def compare_ssim(X, Y, win_size=None, gradient=False,
     D = B1 * B2
     S = (A1 * A2) / D
 
-    # to avoid edge effects will ignore filter radius strip around edges
-    pad = (win_size - 1) // 2
-
     # compute (weighted) mean of ssim
-    mssim = crop(S, pad).mean()
+    mssim = crop(S, pad).mean(dtype=np.float64)
 
     if gradient:
         # The following is Eqs. 7-8 of Avanaki 2009.
@@ -220,3 +266,454 @@ def compare_ssim(X, Y, win_size=None, gradient=False,
             return mssim, S
         else:
             return mssim
+
+
+def compare_ssim_tiled(X, Y, win_size=None, data_range=None,
+                       gaussian_weights=False, full=False, strip_height=1024,
+                       memmap=None, **kwargs):
+    """Compute the mean structural similarity of two 2-D images strip by strip.
+
+    The images are processed in horizontal strips padded with the filter
+    radius from the neighbouring rows, so every strip yields exactly the rows
+    of the full SSIM image it covers while only the strip intermediates are
+    held in memory.
+
+    Parameters
+    ----------
+    X, Y : ndarray
+        2-D images.
+    win_size, data_range, gaussian_weights :
+        As in `compare_ssim`.
+    full : bool, optional
+        If True, also return the full structural similarity image.
+    strip_height : int, optional
+        Number of output rows computed per strip.
+    memmap : str, optional
+        If given (and `full` is True), the SSIM image is written to a ``.npy``
+        memory-mapped file at this path instead of being held in memory.
+
+    Other Parameters
+    ----------------
+    As in `compare_ssim` (`gradient` and `multichannel` are not supported).
+
+    Returns
+    -------
+    mssim : float
+        The mean structural similarity over the image.
+    S : ndarray
+        The full SSIM image (a `numpy.memmap` if `memmap` is given). This is
+        only returned if `full` is set to True.
+    """
+    if not X.dtype == Y.dtype:
+        raise ValueError('Input images must have the same dtype.')
+
+    if not X.shape == Y.shape:
+        raise ValueError('Input images must have the same dimensions.')
+
+    if X.ndim != 2:
+        raise ValueError('Tiled SSIM only supports 2-D images.')
+
+    if kwargs.get('gradient') or kwargs.get('multichannel'):
+        raise ValueError('Tiled SSIM does not support gradient or multichannel.')
+
+    if win_size is None:
+        if gaussian_weights:
+            win_size = 11  # 11 to match Wang et. al. 2004
+        else:
+            win_size = 7   # backwards compatibility
+
+    if data_range is None:
+        dmin, dmax = dtype_range[X.dtype.type]
+        data_range = dmax - dmin
+
+    # rows of context the filter reads on either side of an output row
+    if gaussian_weights:
+        sigma = kwargs.get('sigma', 1.5)
+        radius = int(4.0 * sigma + 0.5)  # ndimage default truncate=4.0
+    else:
+        radius = win_size // 2
+
+    # to avoid edge effects will ignore filter radius strip around edges
+    pad = (win_size - 1) // 2
+
+    H, W = X.shape
+    strip_height = max(int(strip_height), win_size)
+
+    S = None
+    if full:
+        dtype = np.dtype(kwargs.get('dtype', np.float64))
+        if memmap is not None:
+            S = np.lib.format.open_memmap(memmap, mode='w+', dtype=dtype, shape=X.shape)
+        else:
+            S = np.empty(X.shape, dtype=dtype)
+
+    total = 0.0
+    count = 0
+
+    for r0 in range(0, H, strip_height):
+        r1 = min(r0 + strip_height, H)
+
+        # strip rows plus filter context, clipped at the image edges
+        c0 = max(r0 - radius, 0)
+        c1 = min(r1 + radius, H)
+
+        # a short last strip borrows more rows above to fit the window
+        c0 = min(c0, max(c1 - win_size, 0))
+
+        _, S_strip = compare_ssim(X[c0:c1], Y[c0:c1], win_size=win_size,
+                                  data_range=data_range,
+                                  gaussian_weights=gaussian_weights,
+                                  full=True, **kwargs)
+        S_strip = S_strip[r0 - c0:r1 - c0]
+
+        if S is not None:
+            S[r0:r1] = S_strip
+
+        # accumulate the cropped mean over the rows of this strip
+        k0 = max(r0, pad) - r0
+        k1 = min(r1, H - pad) - r0
+        if k1 > k0:
+            inner = S_strip[k0:k1, pad:W - pad]
+            total += inner.sum(dtype=np.float64)
+            count += inner.size
+
+    mssim = total / count
+
+    if full:
+        if memmap is not None:
+            S.flush()
+        return mssim, S
+    else:
+        return mssim
+
+
+def compare_ssim_pyramid(X, Y, levels=2, threshold=0.98, win_size=None,
+                         data_range=None, gaussian_weights=False, full=False,
+                         tolerance=0, **kwargs):
+    """Coarse-to-fine mean structural similarity of two 2-D images.
+
+    SSIM is first computed on both images downsampled by ``2 ** levels``
+    (block mean). The blocks where a pixel differs by more than `tolerance`,
+    or where the coarse SSIM falls below `threshold`, are compared again at
+    full resolution. The other blocks are identical (within `tolerance`).
+    With `tolerance` 0 the pixel differences alone decide, the coarse SSIM
+    is not computed.
+
+    Parameters
+    ----------
+    X, Y : ndarray
+        2-D images.
+    levels : int, optional
+        Number of pyramid levels, the coarse images are ``2 ** levels``
+        times smaller along each axis.
+    threshold : float, optional
+        Coarse SSIM below which a region is escalated to full resolution
+        (with a non-zero `tolerance` only).
+    tolerance : float, optional
+        Largest absolute pixel difference of a block left at the coarse
+        level. With 0 every block with a differing pixel is escalated (a
+        small shift barely changes the block means, it would pass the
+        `threshold` test) and every other block is identical.
+    win_size, data_range, gaussian_weights :
+        As in `compare_ssim`.
+    full : bool, optional
+        If True, also return the full structural similarity image.
+
+    Other Parameters
+    ----------------
+    As in `compare_ssim` (`gradient` and `multichannel` are not supported).
+
+    Returns
+    -------
+    mssim : float
+        The mean structural similarity. Escalated regions contribute their
+        full resolution SSIM, the rest of the image 1.0 (with `tolerance`
+        0 this is the SSIM of the full resolution images).
+    S : ndarray
+        The full SSIM image, exact inside the escalated regions and 1.0
+        everywhere else. This is only returned if `full` is set to True.
+    regions : list of tuple
+        ``(y0, y1, x0, x1)`` full resolution bounds of the escalated regions.
+    """
+    if not X.dtype == Y.dtype:
+        raise ValueError('Input images must have the same dtype.')
+
+    if not X.shape == Y.shape:
+        raise ValueError('Input images must have the same dimensions.')
+
+    if X.ndim != 2:
+        raise ValueError('Pyramid SSIM only supports 2-D images.')
+
+    if kwargs.get('gradient') or kwargs.get('multichannel'):
+        raise ValueError('Pyramid SSIM does not support gradient or multichannel.')
+
+    if win_size is None:
+        if gaussian_weights:
+            win_size = 11  # 11 to match Wang et. al. 2004
+        else:
+            win_size = 7   # backwards compatibility
+
+    if data_range is None:
+        dmin, dmax = dtype_range[X.dtype.type]
+        data_range = dmax - dmin
+
+    if gaussian_weights:
+        radius = int(4.0 * kwargs.get('sigma', 1.5) + 0.5)  # ndimage default truncate=4.0
+    else:
+        radius = win_size // 2
+
+    args = dict(win_size=win_size, data_range=data_range,
+                gaussian_weights=gaussian_weights)
+    args.update(kwargs)
+
+    H, W = X.shape
+    f = 2 ** levels
+    h, w = H // f, W // f
+
+    # too small to downsample, compare at full resolution
+    if h < win_size or w < win_size:
+        mssim, S = compare_ssim(X, Y, full=True, **args)
+        regions = [(0, H, 0, W)]
+        if full:
+            return mssim, S, regions
+        else:
+            return mssim, regions
+
+    # blocks with a pixel difference above tolerance (the last block of a row/column takes the partial edge block)
+    if tolerance == 0:
+        D = X != Y
+    else:
+        D = np.abs(np.subtract(X, Y, dtype=np.float32)) > tolerance
+    D = np.logical_or.reduceat(D, np.arange(0, h * f, f), axis=0)
+    D = np.logical_or.reduceat(D, np.arange(0, w * f, f), axis=1)
+
+    # the other blocks are identical without tolerance, the coarse SSIM would not escalate anything more
+    if tolerance != 0:
+        # block mean pyramid level
+        Xc = X[:h * f, :w * f].reshape(h, f, w, f).mean(axis=(1, 3))
+        Yc = Y[:h * f, :w * f].reshape(h, f, w, f).mean(axis=(1, 3))
+
+        _, Sc = compare_ssim(Xc, Yc, full=True, **args)
+        D |= Sc < threshold
+
+    # regions that stay coarse are identical (within tolerance), the escalated ones are filled in below
+    S = np.ones(X.shape, dtype=kwargs.get('dtype', np.float64))
+
+    # regions of interest: differing blocks or low coarse SSIM, grown by one block to merge neighbours
+    low = binary_dilation(D, iterations=1)
+    labels, _ = label(low)
+
+    margin = radius + f
+    regions = []
+
+    for sl in find_objects(labels):
+        y0 = max(sl[0].start * f - margin, 0)
+        y1 = min(sl[0].stop * f + margin, H)
+        x0 = max(sl[1].start * f - margin, 0)
+        x1 = min(sl[1].stop * f + margin, W)
+        regions.append((y0, y1, x0, x1))
+
+        # full resolution SSIM of the region, with the filter context around it
+        c = (max(y0 - radius, 0), min(y1 + radius, H), max(x0 - radius, 0), min(x1 + radius, W))
+        c = (min(c[0], max(c[1] - win_size, 0)), c[1], min(c[2], max(c[3] - win_size, 0)), c[3])
+        _, S_roi = compare_ssim(X[c[0]:c[1], c[2]:c[3]], Y[c[0]:c[1], c[2]:c[3]], full=True, **args)
+
+        S[y0:y1, x0:x1] = S_roi[y0 - c[0]:y1 - c[0], x0 - c[2]:x1 - c[2]]
+
+    # to avoid edge effects will ignore filter radius strip around edges
+    pad = (win_size - 1) // 2
+    mssim = crop(S, pad).mean(dtype=np.float64)
+
+    if full:
+        return mssim, S, regions
+    else:
+        return mssim, regions
+
+
+def compare_ssim_batch(X, Y, win_size=None, data_range=None,
+                       gaussian_weights=False, full=False, **kwargs):
+    """Compute the mean structural similarity of stacks of 2-D image pairs.
+
+    Parameters
+    ----------
+    X, Y : ndarray
+        Stacks of N images of the same size, shape (N, H, W).
+    win_size : int or None
+        The side-length of the sliding window used in comparison.
+    data_range : int, optional
+        The data range of the input images. By default, this is estimated
+        from the image data-type.
+    gaussian_weights : bool, optional
+        If True, each patch has its mean and variance spatially weighted by a
+        normalized Gaussian kernel of width sigma=1.5.
+    full : bool, optional
+        If True, also return the stack of SSIM images.
+
+    Other Parameters
+    ----------------
+    use_sample_covariance, K1, K2, sigma, dtype
+        As in `compare_ssim`.
+
+    Returns
+    -------
+    mssim : ndarray
+        The mean structural similarity of each pair, shape (N,).
+    S : ndarray
+        The stack of SSIM images, shape (N, H, W). This is only returned if
+        `full` is set to True.
+
+    Notes
+    -----
+    The whole stack goes through each filter call at once, the filters only
+    run along the two spatial axes, so every pair gives the same result as
+    `compare_ssim` on its own while the per call setup is paid once per
+    stack. The SSIM maps are computed in place over the filtered moments
+    (see `reuse_buffers`), use `ssim_batch_size` to size the stacks.
+    """
+    if not X.dtype == Y.dtype:
+        raise ValueError('Input images must have the same dtype.')
+
+    if X.ndim != 3 or not X.shape == Y.shape:
+        raise ValueError('Input images must be (N, H, W) stacks of the same dimensions.')
+
+    K1 = kwargs.pop('K1', 0.01)
+    K2 = kwargs.pop('K2', 0.03)
+    sigma = kwargs.pop('sigma', 1.5)
+    if K1 < 0:
+        raise ValueError("K1 must be positive")
+    if K2 < 0:
+        raise ValueError("K2 must be positive")
+    if sigma < 0:
+        raise ValueError("sigma must be positive")
+    use_sample_covariance = kwargs.pop('use_sample_covariance', True)
+    dtype = np.dtype(kwargs.pop('dtype', np.float64))
+    if dtype not in (np.float32, np.float64):
+        raise ValueError("dtype must be float32 or float64")
+
+    if win_size is None:
+        if gaussian_weights:
+            win_size = 11  # 11 to match Wang et. al. 2004
+        else:
+            win_size = 7   # backwards compatibility
+
+    if np.any((np.asarray(X.shape[1:]) - win_size) < 0):
+        raise ValueError("win_size exceeds image extent.")
+
+    if not (win_size % 2 == 1):
+        raise ValueError('Window size must be odd.')
+
+    if data_range is None:
+        dmin, dmax = dtype_range[X.dtype.type]
+        data_range = dmax - dmin
+
+    # filter the spatial axes only (a size of 1 / sigma of 0 leaves the stack axis alone)
+    if gaussian_weights:
+        filter_func = gaussian_filter
+        filter_args = {'sigma': (0, sigma, sigma)}
+    else:
+        filter_func = uniform_filter
+        filter_args = {'size': (1, win_size, win_size)}
+
+    X = X.astype(dtype)
+    Y = Y.astype(dtype)
+
+    NP = win_size ** 2
+
+    # filter has already normalized by NP
+    if use_sample_covariance:
+        cov_norm = NP / (NP - 1)  # sample covariance
+    else:
+        cov_norm = 1.0  # population covariance to match Wang et. al. 2004
+
+    R = data_range
+    C1 = (K1 * R) ** 2
+    C2 = (K2 * R) ** 2
+
+    S = _ssim_inplace(X, Y, filter_func, filter_args, cov_norm, C1, C2)
+
+    # to avoid edge effects will ignore filter radius strip around edges
+    pad = (win_size - 1) // 2
+    mssim = S[:, pad:S.shape[1] - pad, pad:S.shape[2] - pad].mean(axis=(1, 2), dtype=np.float64)
+
+    if full:
+        return mssim, S
+    else:
+        return mssim
+
+
+def ssim_batch_size(shape, dtype=np.float64, memory=8 << 20):
+    """Number of (H, W) image pairs `compare_ssim_batch` can take within `memory` bytes.
+
+    Per pixel of a pair: the two 8-bit inputs, the two floating point copies
+    and the six buffers of the in place SSIM computation. At least 1.
+
+    Stacking pays off for small images (setup bound, e.g. ~2.5x faster for
+    2000 32x32 pairs); once a stack outgrows the CPU caches the filters are
+    memory bound and larger stacks gain nothing, hence the small default.
+    """
+    height, width = shape[-2:]
+    per_pair = height * width * (2 + 8 * np.dtype(dtype).itemsize)
+
+    return max(1, int(memory // per_pair))
+
+
+def _ssim_inplace(X, Y, filter_func, filter_args, cov_norm, C1, C2, moments=None):
+    """SSIM map computed over six image-sized buffers of the input dtype.
+
+    The filtered moments are overwritten term by term (variances, A2, B1, B2)
+    and the map itself ends up in the scratch buffer, so no intermediate
+    array is allocated beyond the five filter outputs and one scratch array.
+    Precomputed `moments` (ux, uy, uxx, uyy, uxy) are consumed the same way.
+    """
+    tmp = np.empty_like(X)
+
+    if moments is not None:
+        ux, uy, uxx, uyy, uxy = moments
+    else:
+        # compute (weighted) means
+        ux = filter_func(X, **filter_args)
+        uy = filter_func(Y, **filter_args)
+
+        # compute (weighted) second moments
+        np.multiply(X, X, out=tmp)
+        uxx = filter_func(tmp, **filter_args)
+        np.multiply(Y, Y, out=tmp)
+        uyy = filter_func(tmp, **filter_args)
+        np.multiply(X, Y, out=tmp)
+        uxy = filter_func(tmp, **filter_args)
+
+    # variances and covariance: vx -> uxx, vy -> uyy, vxy -> uxy
+    np.multiply(ux, ux, out=tmp)
+    uxx -= tmp
+    uxx *= cov_norm
+    np.multiply(uy, uy, out=tmp)
+    uyy -= tmp
+    uyy *= cov_norm
+    np.multiply(ux, uy, out=tmp)
+    uxy -= tmp
+    uxy *= cov_norm
+
+    # A1 = 2 * ux * uy + C1 -> tmp
+    tmp *= 2
+    tmp += C1
+
+    # A2 = 2 * vxy + C2 -> uxy
+    uxy *= 2
+    uxy += C2
+
+    # B1 = ux ** 2 + uy ** 2 + C1 -> ux
+    ux *= ux
+    uy *= uy
+    ux += uy
+    ux += C1
+
+    # B2 = vx + vy + C2 -> uxx
+    uxx += uyy
+    uxx += C2
+
+    # S = (A1 * A2) / (B1 * B2) -> tmp
+    tmp *= uxy
+    ux *= uxx
+    tmp /= ux
+
+    return tmp
@@ -2,9 +2,57 @@
 import sys
 sys.path.append('.')
 # print(sys.path)
-from core.pdfc import Folder
+from pdfcu.pdfc import Folder
 
 
 if __name__ == "__main__":
 
-    x = Folder('try')
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        # main.py compare <folder_a> <folder_b> <session_folder> [workers]
+        from pdfcu.compare import FolderCompareTask
+
+        workers = int(sys.argv[5]) if len(sys.argv) > 5 else None
+        task = FolderCompareTask(sys.argv[4], sys.argv[2], sys.argv[3], report=True, workers=workers)
+        task.compare_folders()
+
+    elif len(sys.argv) > 1 and sys.argv[1] == 'pdfcompare':
+        # main.py pdfcompare <pdf_a> <pdf_b> <session_folder> [window]
+        from pdfcu.compare import PdfCompareTask
+
+        window = int(sys.argv[5]) if len(sys.argv) > 5 else 1
+        task = PdfCompareTask(sys.argv[4], sys.argv[2], sys.argv[3], report=True, window=window)
+        task.compare_pdfs()
+
+    elif len(sys.argv) > 1 and sys.argv[1] == 'convert':
+        # main.py convert <pdf> <output_folder> [workers] [window]
+        from pdfcu.convert import PdfConvertTask
+
+        workers = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+        window = int(sys.argv[5]) if len(sys.argv) > 5 else 1
+        PdfConvertTask(sys.argv[2], sys.argv[3], report=True, workers=workers, window=window).pdf_to_image([])
+
+    elif len(sys.argv) > 1 and sys.argv[1] == 'queue':
+        # main.py queue <session_folder> <pdf_a> <pdf_b> [<pdf_a> <pdf_b> ...]
+        from pdfcu.distribute import CompareCoordinator
+
+        pdfs = sys.argv[3:]
+        CompareCoordinator(sys.argv[2]).enqueue_pdf_pairs(list(zip(pdfs[0::2], pdfs[1::2])))
+
+    elif len(sys.argv) > 1 and sys.argv[1] == 'work':
+        # main.py work <session_folder> [workers]
+        from pdfcu.distribute import CompareWorker
+
+        workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+        CompareWorker(sys.argv[2], workers=workers).run()
+
+    elif len(sys.argv) > 1 and sys.argv[1] == 'merge':
+        # main.py merge <session_folder> [timeout]
+        from pdfcu.distribute import CompareCoordinator
+
+        timeout = float(sys.argv[3]) if len(sys.argv) > 3 else None
+        coordinator = CompareCoordinator(sys.argv[2])
+        coordinator.wait(timeout=timeout)
+        coordinator.merge()
+
+    else:
+        x = Folder('try')
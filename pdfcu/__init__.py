@@ -0,0 +1,24 @@
+
+# *************************************************************************************
+
+# MODULE NAME: __init__.py
+
+# SYS-REQ: PDFC-SYS-XXX
+
+# SW-REQ: PDFC-SRS-XXX
+
+# MODULE DESCRIPTION: The modules of the utility import each other as the pdfcu package,
+#                     their sources live in core/. This package maps pdfcu.* onto core/
+#                     so main.py (and the tests) run straight from the repository.
+
+# REVISION HISTORY:
+#   $Id$
+#   PCR# N/A
+#   Initial Development
+
+# *************************************************************************************
+
+
+import os
+
+__path__ = [os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'core')]
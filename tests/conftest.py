@@ -0,0 +1,74 @@
+import os
+import sys
+
+import pytest
+
+# pdfcu (see pdfcu/__init__.py) is imported from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True, scope='session')
+def session_log(tmp_path_factory):
+    # Keep the pdfcu log out of the working directory, the log file path is returned
+    try:
+        from pdfcu import pdfc
+    except ImportError:
+        return None
+
+    filename = str(tmp_path_factory.mktemp('log') / pdfc.LOG_FILE)
+    pdfc.configure_logging(filename)
+    return filename
+
+
+def write_page(folder, name, gray):
+    # Converted page image (source__pg_NN.png)
+    import cv2
+
+    path = os.path.join(str(folder), name)
+    cv2.imwrite(path, gray)
+    return path
+
+
+class FakePage:
+    # Rendered PDF page (the wand image attributes the converters use), backed by a grayscale array
+    def __init__(self, array):
+        self.array = array
+        self.height, self.width = array.shape
+        self.size = (self.width, self.height)
+        self.resolution = (320.0, 320.0)
+        self.format = 'PDF'
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_pdf(monkeypatch):
+    # fake_pdf(path, pages) writes a PDF file whose pages render to the given arrays, no Ghostscript needed
+    import cv2
+    from pdfcu.pdfc import PdfFile
+    from pdfcu.generate import GenerateConvertTask
+
+    docs = {}
+
+    def stream_pdf(self, res, window=1, pages=None):
+        self.page_count = len(docs[self.path])
+        self.read_time = 0.0
+        for pg in (range(1, self.page_count + 1) if pages is None else sorted(pages)):
+            yield pg, FakePage(docs[self.path][pg - 1])
+
+    monkeypatch.setattr(PdfFile, 'stream_pdf', stream_pdf)
+    monkeypatch.setattr(PdfFile, 'count_pages', lambda self: len(docs[self.path]))
+    monkeypatch.setattr(GenerateConvertTask, 'save_page',
+                        classmethod(lambda cls, page, output: cv2.imwrite(output, page.array)))
+    monkeypatch.setattr(GenerateConvertTask, 'page_array', classmethod(lambda cls, page: page.array))
+
+    def make(path, pages):
+        path = os.path.abspath(str(path))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'%PDF-1.4\n% ' + path.encode() + b'\n')
+        docs[path] = pages
+        return path
+
+    return make
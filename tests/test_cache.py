@@ -0,0 +1,102 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from conftest import write_page
+
+pytest.importorskip('wand')
+cv2 = pytest.importorskip('cv2')
+
+from pdfcu import compare  # noqa: E402
+from pdfcu.cache import ResultCache  # noqa: E402
+from pdfcu.compare import ImageCompareTask  # noqa: E402
+from pdfcu.pdfc import ImageFile  # noqa: E402
+
+
+@pytest.fixture
+def pages(tmp_path):
+    a = np.full((120, 90), 255, np.uint8)
+    cv2.putText(a, 'ab', (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 1, 0, 2)
+    b = a.copy()
+    b[90:110, 20:40] = 0
+    return write_page(tmp_path, 'a__pg_01.png', a), write_page(tmp_path, 'b__pg_01.png', b)
+
+
+def compare_pair(session, cache, file_a, file_b, **kwargs):
+    task = ImageCompareTask(session, result_cache=cache, **kwargs)
+    task.read_images(file_a, file_b)
+    task.compare_images()
+    return task
+
+
+def test_hit_opens_no_image(tmp_path, pages, monkeypatch):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    first = compare_pair(str(tmp_path / 'session'), cache, *pages)
+
+    assert first.cached is False and first.score < 1.0
+
+    def fail(*args, **kwargs):
+        raise AssertionError('image opened on a cache hit')
+
+    monkeypatch.setattr(ImageFile, 'ping_info', fail)
+    monkeypatch.setattr(compare.cv2, 'imread', fail)
+
+    second = compare_pair(str(tmp_path / 'session'), cache, *pages)
+
+    assert second.cached is True
+    assert (second.score, second.marks, second.diff_regions) == (first.score, first.marks, first.diff_regions)
+
+
+def test_record_has_no_report_row(tmp_path, pages):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    task = compare_pair(str(tmp_path / 'session'), cache, *pages)
+
+    with open(cache.entry_path(task.cache_key, '.json')) as f:
+        assert 'row' not in json.load(f)
+
+
+@pytest.mark.parametrize('kwargs', [{'region_gap': 64}, {'mark_crops': True}, {'ssim_args': {'win_size': 9}}])
+def test_key_covers_parameters(tmp_path, pages, kwargs):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    compare_pair(str(tmp_path / 'session'), cache, *pages)
+
+    task = compare_pair(str(tmp_path / 'session'), cache, *pages, **kwargs)
+
+    assert task.cached is False
+
+
+def test_missing_artifacts_are_recomputed(tmp_path, pages):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    first = compare_pair(str(tmp_path / 'session'), cache, *pages)
+    os.remove(first.artifacts['diff'])
+
+    second = compare_pair(str(tmp_path / 'session'), cache, *pages)
+
+    assert second.cached is False
+    assert os.path.isfile(second.artifacts['diff'])
+
+
+def test_caches_on_one_directory_share_the_size_limit(tmp_path, monkeypatch):
+    from pdfcu.cache import FileCache
+
+    source = tmp_path / 'entry.bin'
+    source.write_bytes(b'x' * 100)
+
+    first, second = FileCache(str(tmp_path / 'cache'), max_bytes=450), FileCache(str(tmp_path / 'cache'), max_bytes=450)
+    first.store(first.make_key(0), '.bin', str(source))
+
+    # the other cache takes the size from the size file, no directory scan before the limit is reached
+    scans = []
+    evict = FileCache.evict
+    monkeypatch.setattr(FileCache, 'evict', lambda self: scans.append(self) or evict(self))
+
+    for i in range(1, 10):
+        cache = (first, second)[i % 2]
+        cache.store(cache.make_key(i), '.bin', str(source))
+
+    entries = [e for sub in (tmp_path / 'cache').iterdir() if sub.is_dir() for e in sub.iterdir()]
+    assert sum(e.stat().st_size for e in entries) <= 450
+    assert int((tmp_path / 'cache' / FileCache.SIZE_FILE).read_text()) == 400
+    assert len(scans) == 6 and scans[0] is first
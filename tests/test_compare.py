@@ -0,0 +1,201 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import write_page
+
+pytest.importorskip('wand')
+pytest.importorskip('cv2')
+
+from pdfcu.compare import FolderCompareTask  # noqa: E402
+
+
+def page(value=255, shape=(48, 32)):
+    return np.full(shape, value, np.uint8)
+
+
+def test_scan_pages_keeps_every_source(tmp_path):
+    for name in ('manual__pg_01.png', 'guide__pg_01.png', 'manual__pg_02.png'):
+        write_page(tmp_path, name, page())
+    (tmp_path / 'manual__pg_xx.png').write_bytes(b'')
+    (tmp_path / 'notes.txt').write_text('not a page')
+
+    pages = FolderCompareTask.scan_pages(str(tmp_path))
+
+    assert sorted(pages) == [('guide', 1), ('manual', 1), ('manual', 2)]
+    assert pages[('guide', 1)].endswith('guide__pg_01.png')
+
+
+def test_pair_pages_by_source_and_page(tmp_path):
+    folder_a, folder_b = tmp_path / 'a', tmp_path / 'b'
+    folder_a.mkdir()
+    folder_b.mkdir()
+
+    for name in ('manual__pg_01.png', 'guide__pg_01.png', 'guide__pg_02.png'):
+        write_page(folder_a, name, page())
+    for name in ('manual__pg_01.png', 'guide__pg_01.png', 'manual__pg_02.png'):
+        write_page(folder_b, name, page())
+
+    task = FolderCompareTask(str(tmp_path / 'session'), str(folder_a), str(folder_b))
+    pairs = task.pair_pages()
+
+    assert [(os.path.basename(a), os.path.basename(b)) for a, b in pairs] == \
+        [('guide__pg_01.png', 'guide__pg_01.png'), ('manual__pg_01.png', 'manual__pg_01.png')]
+    assert [(side, key) for side, key, _ in task.unmatched] == [('a', ('guide', 2)), ('b', ('manual', 2))]
+
+
+def test_pair_pages_single_source_by_page(tmp_path):
+    folder_a, folder_b = tmp_path / 'a', tmp_path / 'b'
+    folder_a.mkdir()
+    folder_b.mkdir()
+
+    write_page(folder_a, 'manual__pg_01.png', page())
+    write_page(folder_b, 'manual_rev2__pg_01.png', page())
+
+    task = FolderCompareTask(str(tmp_path / 'session'), str(folder_a), str(folder_b))
+
+    assert len(task.pair_pages()) == 1
+    assert task.unmatched == []
+
+
+def test_missing_folder_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        FolderCompareTask(str(tmp_path / 'session'), str(tmp_path), str(tmp_path / 'missing'))
+
+    assert not (tmp_path / 'missing').exists()
+
+
+def test_compare_folders_reports_unmatched_pages(tmp_path):
+    folder_a, folder_b = tmp_path / 'a', tmp_path / 'b'
+    folder_a.mkdir()
+    folder_b.mkdir()
+
+    write_page(folder_a, 'manual__pg_01.png', page())
+    write_page(folder_a, 'manual__pg_02.png', page())
+    write_page(folder_b, 'manual__pg_01.png', page())
+
+    task = FolderCompareTask(str(tmp_path / 'session'), str(folder_a), str(folder_b), workers=1)
+    results = task.compare_folders()
+
+    assert len(results) == 2
+    assert results[0].valid and results[0].score == 1.0
+    assert not results[1].valid and results[1].score is None
+    assert (results[1].source_a, results[1].page_a, results[1].source_b) == ('manual', 2, None)
+
+
+def marked_pairs(tmp_path, count, shape=(48, 32)):
+    pairs = []
+    for pg in range(1, count + 1):
+        a = page(shape=shape)
+        a[10:20, 5:5 + pg] = 0
+        b = a.copy()
+        if pg % 3:
+            b[30:34, 10:14] = 0
+        pairs.append((write_page(tmp_path, 'a__pg_{:02d}.png'.format(pg), a),
+                      write_page(tmp_path, 'b__pg_{:02d}.png'.format(pg), b)))
+    return pairs
+
+
+def test_page_batch_matches_single_pairs(tmp_path):
+    from pdfcu.compare import compare_page_batch, compare_page_pair
+
+    pairs = marked_pairs(tmp_path, 7)
+
+    single = [compare_page_pair(str(tmp_path / 'single'), a, b) for a, b in pairs]
+    batch = compare_page_batch(str(tmp_path / 'batch'), pairs)
+
+    assert [(r.page_a, r.score, r.fastpath) for r in batch] == [(r.page_a, r.score, r.fastpath) for r in single]
+
+
+def test_page_batch_decodes_one_stack_at_a_time(tmp_path, monkeypatch):
+    from pdfcu import compare
+    from pdfcu.util.ssim import ssim_batch_size
+
+    pairs = marked_pairs(tmp_path, 9)
+    memory = 2 * 48 * 32 * (2 + 8 * 8)
+    assert ssim_batch_size((48, 32), memory=memory) == 2
+
+    decoded, peak, stacks = set(), [0], []
+    decode_images, compare_images = compare.ImageCompareTask.decode_images, compare.ImageCompareTask.compare_images
+    compare_ssim_batch = compare.compare_ssim_batch
+
+    def decode(task):
+        decode_images(task)
+        decoded.add(id(task))
+        peak[0] = max(peak[0], len(decoded))
+
+    def done(task):
+        compare_images(task)
+        decoded.discard(id(task))
+
+    def batch(X, Y, **kwargs):
+        stacks.append(len(X))
+        return compare_ssim_batch(X, Y, **kwargs)
+
+    monkeypatch.setattr(compare.ImageCompareTask, 'decode_images', decode)
+    monkeypatch.setattr(compare.ImageCompareTask, 'compare_images', done)
+    monkeypatch.setattr(compare, 'compare_ssim_batch', batch)
+
+    records = compare.compare_page_batch(str(tmp_path / 'batch'), pairs, memory=memory)
+
+    assert len(records) == 9 and all(r.valid for r in records)
+    assert stacks == [2, 2, 2]
+    assert peak[0] <= 2
+
+
+def test_pdf_compare_reports_extra_pages(tmp_path, fake_pdf):
+    from pdfcu.compare import PdfCompareTask
+
+    first, second = page(), page()
+    second[10:20, 10:20] = 0
+
+    # same name on both sides, B has one more page
+    pdf_a = fake_pdf(tmp_path / 'v1' / 'manual.pdf', [first, first])
+    pdf_b = fake_pdf(tmp_path / 'v2' / 'manual.pdf', [first, second, second])
+
+    results = PdfCompareTask(str(tmp_path / 'session'), pdf_a, pdf_b).compare_pdfs()
+
+    assert [(r.page_a, r.page_b, r.valid) for r in results] == [(1, 1, True), (2, 2, True), (None, 3, False)]
+    assert results[1].image_a_path != results[1].image_b_path
+    assert os.path.isfile(results[2].image_b_path) and results[2].image_a_path is None
+
+
+def test_tiled_compare_removes_the_ssim_memmap(tmp_path):
+    from pdfcu.compare import ImageCompareTask
+
+    file_a, file_b = marked_pairs(tmp_path, 2, shape=(96, 64))[0]
+
+    task = ImageCompareTask(str(tmp_path / 'session'), tile_pixels=1000, tile_rows=32, tile_memmap=True)
+    task.read_images(file_a, file_b)
+    task.compare_images()
+
+    assert task.score < 1.0 and os.path.isfile(task.artifacts['diff'])
+    assert os.listdir(str(tmp_path / 'session' / 'ssim')) == []
+
+
+def test_page_workers_write_through_their_own_writer(tmp_path, monkeypatch):
+    from pdfcu import compare
+
+    writers = []
+
+    class Writer(compare.ArtifactWriter):
+        def __init__(self, *args):
+            super(Writer, self).__init__(*args)
+            self.paths = []
+            writers.append(self)
+
+        def write(self, path, img):
+            self.paths.append(path)
+            super(Writer, self).write(path, img)
+
+    monkeypatch.setattr(compare, 'ArtifactWriter', Writer)
+
+    pairs = marked_pairs(tmp_path, 4)
+    batch = compare.compare_page_batch(str(tmp_path / 'batch'), pairs)
+    single = compare.compare_page_pair(str(tmp_path / 'single'), *pairs[1])
+
+    assert len(writers) == 2
+    assert sorted(writers[0].paths) == sorted(p for r in batch if r.diff_path for p in (r.diff_path, r.thres_path))
+    assert writers[1].paths == [single.diff_path, single.thres_path]
+    assert all(os.path.isfile(path) for writer in writers for path in writer.paths)
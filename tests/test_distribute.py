@@ -0,0 +1,74 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip('wand')
+cv2 = pytest.importorskip('cv2')
+
+from pdfcu.distribute import WorkQueue, CompareCoordinator, CompareWorker  # noqa: E402
+
+
+def text_page(text, mark=False):
+    page = np.full((200, 160), 255, np.uint8)
+    cv2.putText(page, text, (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 1, 0, 2)
+    if mark:
+        cv2.rectangle(page, (40, 120), (120, 170), 0, -1)
+    return page
+
+
+def test_same_name_pdfs_are_compared(tmp_path, fake_pdf):
+    # v1/manual.pdf vs v2/manual.pdf: both sides are converted into their own folders
+    pdf_a = fake_pdf(tmp_path / 'v1' / 'manual.pdf', [text_page('one'), text_page('two')])
+    pdf_b = fake_pdf(tmp_path / 'v2' / 'manual.pdf', [text_page('one'), text_page('two', mark=True)])
+
+    coordinator = CompareCoordinator(str(tmp_path / 'session'))
+    coordinator.enqueue_pdf_pairs([(pdf_a, pdf_b)])
+    CompareWorker(str(tmp_path / 'session'), worker='w1').run()
+
+    assert coordinator.wait(poll=0, timeout=5) == {'done': 1}
+
+    records = coordinator.merge()
+    assert [(r.page_a, r.page_b) for r in records] == [(1, 1), (2, 2)]
+    assert records[0].score == 1.0
+    assert records[1].score < 0.99
+    assert records[1].marks and all(isinstance(m, tuple) for m in records[1].marks + records[1].regions)
+
+
+def test_wait_reaps_crashed_jobs(tmp_path):
+    coordinator = CompareCoordinator(str(tmp_path), max_attempts=1)
+    coordinator.enqueue_page_pairs([('a__pg_01.png', 'b__pg_01.png')])
+
+    # the only worker dies right after its claim
+    assert coordinator.queue.claim('ghost', lease=0.01) is not None
+    time.sleep(0.05)
+
+    assert coordinator.wait(poll=0, timeout=5) == {'failed': 1}
+    assert coordinator.queue.failures()[0][4] == 'lease expired'
+
+
+def test_wait_timeout(tmp_path):
+    coordinator = CompareCoordinator(str(tmp_path), max_attempts=3)
+    coordinator.enqueue_page_pairs([('a__pg_01.png', 'b__pg_01.png')])
+
+    # retried job, but no worker left to take it
+    coordinator.queue.claim('ghost', lease=0.01)
+    time.sleep(0.05)
+
+    with pytest.raises(TimeoutError):
+        coordinator.wait(poll=0.01, timeout=0.05)
+
+    assert coordinator.queue.status() == {'pending': 1}
+
+
+def test_failed_job_stops_heartbeat(tmp_path):
+    queue = WorkQueue(str(tmp_path), max_attempts=1)
+    queue.enqueue('unknown', [{}])
+
+    threads = threading.active_count()
+    CompareWorker(str(tmp_path), worker='w1').run()
+
+    assert threading.active_count() == threads
+    assert queue.status() == {'failed': 1}
+    assert 'Job kind not supported' in queue.failures()[0][4]
@@ -0,0 +1,107 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('wand')
+cv2 = pytest.importorskip('cv2')
+
+from pdfcu.generate import ArtifactWriter  # noqa: E402
+
+
+def test_writer_writes_queued_images(tmp_path):
+    paths = [str(tmp_path / 'img_{}.png'.format(i)) for i in range(5)]
+
+    with ArtifactWriter(threads=2, max_pending=2) as writer:
+        for path in paths:
+            writer.write(path, np.zeros((8, 8), np.uint8))
+
+    assert all(os.path.isfile(path) for path in paths)
+
+
+def test_writer_survives_any_error(tmp_path, monkeypatch):
+    from pdfcu import generate
+
+    imwrite = generate.cv2.imwrite
+
+    def failing_imwrite(path, img):
+        if 'bad' in path:
+            raise MemoryError('no memory left')
+        return imwrite(path, img)
+
+    monkeypatch.setattr(generate.cv2, 'imwrite', failing_imwrite)
+
+    # more failures than threads and queue slots: the threads must keep draining the queue
+    writer = ArtifactWriter(threads=1, max_pending=1)
+    for i in range(4):
+        writer.write(str(tmp_path / 'bad_{}.png'.format(i)), np.zeros((8, 8), np.uint8))
+    writer.write(str(tmp_path / 'good.png'), np.zeros((8, 8), np.uint8))
+
+    with pytest.raises(IOError) as error:
+        writer.close()
+
+    assert 'bad_3.png' in str(error.value)
+    assert os.path.isfile(str(tmp_path / 'good.png'))
+
+
+def test_writer_does_not_hide_the_propagating_exception(tmp_path):
+    with pytest.raises(KeyError):
+        with ArtifactWriter(threads=1) as writer:
+            writer.write(str(tmp_path / 'missing' / 'img.png'), np.zeros((8, 8), np.uint8))
+            raise KeyError('compare failed')
+
+
+def test_selected_pages_report_cache_hits(tmp_path, fake_pdf, capsys):
+    from pdfcu.cache import PageCache
+    from pdfcu.convert import PdfConvertTask
+
+    pdf = fake_pdf(tmp_path / 'doc.pdf', [np.full((40, 30), value, np.uint8) for value in (0, 128, 255)])
+    cache = PageCache(str(tmp_path / 'cache'))
+
+    PdfConvertTask(pdf, str(tmp_path / 'first'), cache=cache).pdf_to_image([1, 2])
+    capsys.readouterr()
+
+    PdfConvertTask(pdf, str(tmp_path / 'second'), cache=cache).pdf_to_image([1, 2, 3])
+    out = capsys.readouterr().out
+
+    assert 'Generating converted image' not in out
+    assert out.count('Taken from the page cache') == 2
+    assert 'Generated converted image: doc__pg_03.jpg' in out
+
+
+def test_diff_image_made_strip_by_strip(tmp_path):
+    import tracemalloc
+    from pdfcu.generate import GenerateCompareTask
+
+    ssim_map = np.lib.format.open_memmap(str(tmp_path / 'ssim.npy'), mode='w+', dtype='float64', shape=(1024, 512))
+    ssim_map[:] = 0.5
+
+    tracemalloc.start()
+    diff = GenerateCompareTask(str(tmp_path)).generate_diff(ssim_map, str(tmp_path / 'diff.png'), rows=64)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    assert diff.dtype == np.uint8 and (diff == 127).all()
+    # the uint8 image plus one strip, far from the full size float temporary
+    assert peak < diff.nbytes + ssim_map.nbytes // 4
+
+
+def test_convert_reads_the_pdf_by_window(tmp_path, fake_pdf, monkeypatch):
+    from pdfcu.convert import PdfConvertTask
+    from pdfcu.pdfc import PdfFile
+
+    pdf = fake_pdf(tmp_path / 'doc.pdf', [np.full((40, 30), value, np.uint8) for value in (0, 128, 255)])
+
+    windows = []
+    stream_pdf = PdfFile.stream_pdf
+
+    def windowed(self, res, window=1, pages=None):
+        windows.append(window)
+        return stream_pdf(self, res, window, pages)
+
+    monkeypatch.setattr(PdfFile, 'stream_pdf', windowed)
+
+    PdfConvertTask(pdf, str(tmp_path / 'out'), window=4).pdf_to_image([])
+
+    assert windows == [4]
+    assert len(os.listdir(str(tmp_path / 'out' / 'doc'))) == 3
@@ -0,0 +1,111 @@
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+pytest.importorskip('wand')
+
+from pdfcu import pdfc  # noqa: E402
+
+
+def log_error(message):
+    pdfc.Folder.log.error(message)
+    return multiprocessing.current_process().pid
+
+
+def read_log(filename, *expected, timeout=10):
+    # records are written by a listener thread: wait for the expected ones to reach the file
+    deadline = time.time() + timeout
+    while True:
+        with open(filename) as f:
+            text = f.read()
+        if all(e in text for e in expected) or time.time() > deadline:
+            return text
+        time.sleep(0.05)
+
+
+# forked workers (ProcessPoolExecutor on Linux) restart the log listener of their own
+fork_only = pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(),
+                               reason='fork start method not available')
+
+
+@fork_only
+def test_fork_started_workers_log_to_the_file(session_log):
+    messages = ['worker error {}'.format(i) for i in range(4)]
+
+    with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('fork')) as pool:
+        pids = set(pool.map(log_error, messages))
+
+    assert pids and multiprocessing.current_process().pid not in pids
+
+    text = read_log(session_log, *messages)
+    for message in messages:
+        assert message in text
+
+
+@fork_only
+def test_parent_still_logs_after_fork(session_log):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork')) as pool:
+        pool.submit(log_error, 'child').result()
+
+    pdfc.Folder.log.log(logging.ERROR, 'parent after fork')
+
+    assert 'parent after fork' in read_log(session_log, 'parent after fork')
+
+
+def write_pdf(path, *parts):
+    path.write_bytes(b'%PDF-1.4\n' + b'\n'.join(parts) + b'\n%%EOF\n')
+    return pdfc.PdfFile(str(path))
+
+
+CATALOG = b'1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj'
+
+
+def test_scan_page_count(tmp_path):
+    pdf = write_pdf(tmp_path / 'doc.pdf', CATALOG,
+                    b'2 0 obj\n<< /Type /Pages /Kids [3 0 R 4 0 R 5 0 R] /Count 3 >>\nendobj',
+                    b'trailer\n<< /Size 6 /Root 1 0 R >>')
+
+    assert pdf.scan_page_count() == 3
+
+
+def test_scan_page_count_nested_dictionaries(tmp_path):
+    pdf = write_pdf(tmp_path / 'doc.pdf', CATALOG,
+                    b'2 0 obj\n<< /Type /Pages /Resources << /Font << /F1 9 0 R >> >> /Kids [3 0 R 4 0 R] /Count 2 >>'
+                    b'\nendobj',
+                    b'trailer\n<< /Size 6 /Root 1 0 R >>')
+
+    assert pdf.scan_page_count() == 2
+
+
+def test_scan_page_count_incremental_update(tmp_path):
+    # pages removed by an update: the old page tree is still in the file, with a larger /Count
+    pdf = write_pdf(tmp_path / 'doc.pdf', CATALOG,
+                    b'2 0 obj\n<< /Type /Pages /Kids [3 0 R 4 0 R 5 0 R 6 0 R] /Count 4 >>\nendobj',
+                    b'trailer\n<< /Size 7 /Root 1 0 R >>',
+                    b'%%EOF',
+                    b'2 0 obj\n<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj',
+                    b'12 0 obj\n<< /Type /Pages /Kids [] /Count 9 >>\nendobj',
+                    b'trailer\n<< /Size 13 /Root 1 0 R /Prev 9 >>')
+
+    assert pdf.scan_page_count() == 1
+
+
+def test_scan_page_count_compressed(tmp_path):
+    # page tree in an object stream: nothing to scan, the page count is pinged instead
+    pdf = write_pdf(tmp_path / 'doc.pdf', b'7 0 obj\n<< /Type /XRef /Root 1 0 R /Filter /FlateDecode >>\nstream\nx\n'
+                                          b'endstream\nendobj')
+
+    assert pdf.scan_page_count() is None
+
+
+def test_select_pages_reports_out_of_range(tmp_path, caplog):
+    pdf = write_pdf(tmp_path / 'doc.pdf', b'')
+    pdf.page_count = 3
+
+    with caplog.at_level(logging.WARNING, logger='pdfcu'):
+        assert pdf.select_pages([3, 0, 5, 1]) == [1, 3]
+
+    assert 'out of range' in caplog.text and '[0, 5]' in caplog.text
@@ -0,0 +1,49 @@
+import tracemalloc
+
+import numpy as np
+
+from pdfcu.util.regions import merge_boxes, region_scores
+
+
+def test_merge_boxes_gap_is_inclusive():
+    # 16 px apart: merged, 17 px apart: kept apart
+    assert merge_boxes([(0, 0, 10, 10), (26, 0, 10, 10)], gap=16) == [(0, 0, 36, 10)]
+    assert merge_boxes([(0, 0, 10, 10), (27, 0, 10, 10)], gap=16) == [(0, 0, 10, 10), (27, 0, 10, 10)]
+
+
+def test_merge_boxes_chains_and_sorts():
+    boxes = [(200, 300, 5, 5), (0, 0, 10, 10), (20, 0, 10, 10), (40, 0, 10, 10), (100, 100, 4, 4)]
+
+    assert merge_boxes(boxes, gap=10, cell=8) == [(0, 0, 50, 10), (100, 100, 4, 4), (200, 300, 5, 5)]
+
+
+def test_merge_boxes_grown_box_reaches_more():
+    # the merged box of the first two reaches the third one, which neither part did
+    boxes = [(0, 0, 10, 40), (12, 0, 10, 10), (24, 30, 5, 5)]
+
+    assert merge_boxes(boxes, gap=4) == [(0, 0, 29, 40)]
+
+
+def test_region_scores():
+    rng = np.random.default_rng(0)
+    S = rng.random((64, 48))
+    regions = [(0, 0, 48, 64), (5, 7, 10, 3), (47, 63, 1, 1)]
+
+    expected = [S.mean(), S[7:10, 5:15].mean(), S[63, 47]]
+
+    np.testing.assert_allclose(region_scores(S, regions), expected)
+
+
+def test_region_scores_memory_mapped(tmp_path):
+    S = np.lib.format.open_memmap(str(tmp_path / 'ssim.npy'), mode='w+', dtype=np.float32, shape=(4000, 3000))
+    S[:] = 1.0
+    S[100:110, 200:220] = 0.5
+    S.flush()
+
+    tracemalloc.start()
+    scores = region_scores(S, [(200, 100, 20, 10), (190, 100, 40, 10)])
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    np.testing.assert_allclose(scores, [0.5, 0.75])
+    assert peak < S.nbytes // 10
@@ -0,0 +1,99 @@
+import csv
+
+import pytest
+
+pytest.importorskip('wand')
+pd = pytest.importorskip('pandas')
+
+from pdfcu.records import ComparisonRecord  # noqa: E402
+from pdfcu.report import ImageComparisonReporter, ReportGleaner, append_report_rows  # noqa: E402
+
+# columns of the comparison reports written before the fastpath/cached/marks/regions columns
+OLD_COLUMNS = ['source_a', 'page_a', 'source_b', 'page_b', 'score', 'ctype', 'valid', 'name', 'duration', 'date',
+               'image_a_path', 'image_b_path', 'diff_path', 'thres_path', 'marks_a_path', 'marks_b_path']
+
+
+def record(page, score=0.95):
+    return ComparisonRecord('a', page, 'b', page, score, 'batch', True, 'a_vs_b', 0.01, '2026-01-01 00:00:00',
+                            '/a.png', '/b.png', '/diff.jpg', '/thres.jpg', None, None, None, False, (), ())
+
+
+def test_append_writes_header_once(tmp_path):
+    path = str(tmp_path / '_comparison.report')
+
+    append_report_rows(path, ['x', 'y'], [[1, 2]])
+    append_report_rows(path, ['x', 'y'], [[3, 4], [5, 6]])
+
+    with open(path) as f:
+        assert f.read() == 'x,y\n1,2\n3,4\n5,6\n'
+
+
+def test_append_to_old_report_migrates_it(tmp_path):
+    path = tmp_path / '_comparison.report'
+    with open(str(path), 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(OLD_COLUMNS)
+        writer.writerow(['old', 1, 'old', 1, '1.00000', 'manual', True, 'old_vs_old', '0.50000', '2017-11-06 07:31:03',
+                         '/o.png', '/o.png', '/d.jpg', '/t.jpg', '/ma.png', '/mb.png'])
+
+    ImageComparisonReporter(str(tmp_path)).create_batch_report([record(2)])
+
+    df = ReportGleaner.read_report('comparison', str(path))[1]
+
+    assert list(df.columns) == list(ComparisonRecord._fields)
+    assert list(df['source_a']) == ['old', 'a']
+    assert df['marks_a_path'][0] == '/ma.png' and pd.isna(df['regions'][0])
+    assert df['regions'][1] == '[]'
+
+
+def test_append_to_unknown_report_fails(tmp_path):
+    path = tmp_path / '_comparison.report'
+    path.write_text('source_a,unknown\nx,y\n')
+
+    with pytest.raises(ValueError):
+        append_report_rows(str(path), list(ComparisonRecord._fields), [list(record(1))])
+
+    assert path.read_text() == 'source_a,unknown\nx,y\n'
+
+
+def test_records_are_formatted_when_written(tmp_path):
+    from pdfcu.report import SessionDatabase
+
+    rec = record(1, score=0.951234)._replace(marks=((1, 2, 3, 4),), regions=((1, 2, 3, 4, 0.5, 1),))
+
+    ImageComparisonReporter(str(tmp_path / 'csv')).create_batch_report([rec])
+    ImageComparisonReporter(str(tmp_path / 'db'), backend='sqlite').create_batch_report([rec])
+
+    with open(str(tmp_path / 'csv' / '_comparison.report')) as f:
+        row = list(csv.DictReader(f))[0]
+    assert (row['score'], row['duration']) == ('0.95123', '0.01000')
+    assert row['marks'] == '[[1, 2, 3, 4]]'
+    assert row['regions'] == '[{"x": 1, "y": 2, "w": 3, "h": 4, "score": 0.5, "marks": 1}]'
+
+    df = SessionDatabase(str(tmp_path / 'db')).read_comparisons()
+    assert df['score'][0] == 0.951234
+    assert (df['marks'][0], df['regions'][0]) == (row['marks'], row['regions'])
+
+
+def test_incremental_scans_keep_each_other_state(tmp_path, monkeypatch):
+    session = tmp_path / 'session'
+    session.mkdir()
+    (session / '_conversion.report').write_text('source,page\ndoc,1\n')
+    ImageComparisonReporter(str(session)).create_batch_report([record(1)])
+
+    def scan(gleaner):
+        gleaner.scan_conversions(str(session))
+        gleaner.scan_comparisons(str(session))
+        return gleaner
+
+    scan(ReportGleaner('all', str(session), str(tmp_path / 'out'), incremental=True))
+
+    reads = []
+    read_report = ReportGleaner.read_report
+    monkeypatch.setattr(ReportGleaner, 'read_report', staticmethod(lambda kind, path: reads.append(kind) or
+                                                                   read_report(kind, path)))
+
+    gleaner = scan(ReportGleaner('all', str(session), str(tmp_path / 'out'), incremental=True))
+
+    assert reads == []
+    assert list(gleaner.conv_df['source']) == ['doc'] and list(gleaner.comp_df['page_a']) == [1]
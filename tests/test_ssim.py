@@ -0,0 +1,167 @@
+import numpy as np
+import pytest
+
+from pdfcu.util.ssim import compare_ssim, compare_ssim_pyramid, compare_ssim_tiled, compare_ssim_batch, ssim_batch_size
+
+
+def text_page(shift=0, shape=(256, 192)):
+    # white page with a few dark 'glyphs', shifted right by `shift` pixels
+    page = np.full(shape, 255, np.uint8)
+    for y in range(40, 200, 40):
+        for x in range(20, 160, 24):
+            page[y:y + 12, x + shift:x + shift + 3] = 0
+            page[y + 5:y + 7, x + shift:x + shift + 10] = 0
+    return page
+
+
+def test_pyramid_identical_pages():
+    X = text_page()
+
+    mssim, S, regions = compare_ssim_pyramid(X, X.copy(), full=True)
+
+    assert mssim == 1.0
+    assert regions == []
+    assert (S == 1.0).all()
+
+
+def test_pyramid_one_pixel_shift():
+    # block means barely move, the shift must still be compared at full resolution
+    X, Y = text_page(), text_page(shift=1)
+
+    full_mssim, full_S = compare_ssim(X, Y, full=True)
+    mssim, S, regions = compare_ssim_pyramid(X, Y, full=True)
+
+    assert full_mssim < 1.0
+    assert regions
+    assert mssim == pytest.approx(full_mssim, abs=1e-9)
+    assert S.min() == pytest.approx(full_S.min(), abs=1e-9)
+
+
+def test_pyramid_local_change():
+    X = text_page()
+    Y = X.copy()
+    Y[100:104, 100:104] = 128
+
+    full_mssim = compare_ssim(X, Y)
+    mssim, regions = compare_ssim_pyramid(X, Y)
+
+    assert len(regions) == 1
+    y0, y1, x0, x1 = regions[0]
+    assert y0 <= 100 and 104 <= y1 and x0 <= 100 and 104 <= x1
+    assert mssim == pytest.approx(full_mssim, abs=1e-9)
+
+
+def test_pyramid_tolerance():
+    # differences within tolerance stay at the coarse level
+    X = text_page()
+    Y = X.copy()
+    Y[Y == 255] = 254
+
+    assert compare_ssim_pyramid(X, Y, tolerance=1)[1] == []
+    assert compare_ssim_pyramid(X, Y)[1] != []
+
+
+def test_pyramid_coarse_ssim_escalates_within_tolerance():
+    # low contrast pattern in a blank area: every pixel within tolerance, only the coarse SSIM catches it
+    X = text_page()
+    Y = X.copy()
+    checker = (np.indices((32, 32)) // 8).sum(axis=0) % 2
+    Y[208:240, 64:96] = 255 - 8 * checker
+
+    regions = compare_ssim_pyramid(X, Y, tolerance=10)[1]
+
+    assert len(regions) == 1
+    y0, y1, x0, x1 = regions[0]
+    assert y0 <= 208 and 240 <= y1 and x0 <= 64 and 96 <= x1
+    assert compare_ssim_pyramid(X, Y, tolerance=10, threshold=0.0)[1] == []
+
+
+def test_pyramid_without_tolerance_skips_the_coarse_ssim(monkeypatch):
+    from pdfcu.util import ssim
+
+    shapes = []
+    compare = ssim.compare_ssim
+
+    def counted(X, Y, **kwargs):
+        shapes.append(X.shape)
+        return compare(X, Y, **kwargs)
+
+    monkeypatch.setattr(ssim, 'compare_ssim', counted)
+
+    X = text_page()
+    Y = X.copy()
+    Y[100:104, 100:104] = 128
+    regions = compare_ssim_pyramid(X, Y)[1]
+
+    # the full resolution region only
+    assert len(shapes) == len(regions) == 1 and shapes[0] != (64, 48)
+
+
+def noisy_pair(shape=(96, 80), seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.integers(0, 256, shape, dtype=np.uint8)
+    Y = np.clip(X.astype(np.int16) + rng.integers(-20, 21, shape), 0, 255).astype(np.uint8)
+    return X, Y
+
+
+@pytest.mark.parametrize('gaussian_weights', [False, True])
+def test_float32_and_reused_buffers(gaussian_weights):
+    X, Y = noisy_pair()
+    mssim, S = compare_ssim(X, Y, full=True, gaussian_weights=gaussian_weights)
+
+    mssim_r, S_r = compare_ssim(X, Y, full=True, gaussian_weights=gaussian_weights, reuse_buffers=True)
+    assert mssim_r == pytest.approx(mssim, abs=1e-12)
+    np.testing.assert_allclose(S_r, S, atol=1e-12)
+
+    mssim_32, S_32 = compare_ssim(X, Y, full=True, gaussian_weights=gaussian_weights, dtype=np.float32)
+    assert S_32.dtype == np.float32
+    assert mssim_32 == pytest.approx(mssim, abs=1e-4)
+    np.testing.assert_allclose(S_32, S, atol=1e-3)
+
+
+@pytest.mark.parametrize('win_size', [7, 11])
+def test_integral_engine_matches_filter(win_size):
+    X, Y = noisy_pair(seed=1)
+
+    mssim, S = compare_ssim(X, Y, full=True, win_size=win_size)
+    mssim_i, S_i = compare_ssim(X, Y, full=True, win_size=win_size, engine='integral')
+
+    assert mssim_i == pytest.approx(mssim, abs=1e-9)
+    np.testing.assert_allclose(S_i, S, atol=1e-9)
+
+
+@pytest.mark.parametrize('strip_height', [16, 40, 1000])
+def test_tiled_matches_full(strip_height, tmp_path):
+    X, Y = noisy_pair(shape=(130, 70), seed=2)
+
+    mssim, S = compare_ssim(X, Y, full=True)
+    mssim_t, S_t = compare_ssim_tiled(X, Y, full=True, strip_height=strip_height)
+
+    assert mssim_t == pytest.approx(mssim, abs=1e-12)
+    np.testing.assert_allclose(S_t, S, atol=1e-12)
+
+    # map written to a memory-mapped .npy file
+    mssim_m, S_m = compare_ssim_tiled(X, Y, full=True, strip_height=strip_height, memmap=str(tmp_path / 'S.npy'))
+
+    assert mssim_m == pytest.approx(mssim, abs=1e-12)
+    np.testing.assert_allclose(np.load(str(tmp_path / 'S.npy')), S, atol=1e-12)
+
+
+@pytest.mark.parametrize('gaussian_weights', [False, True])
+def test_batch_matches_single_pairs(gaussian_weights):
+    pairs = [noisy_pair(shape=(40, 36), seed=seed) for seed in range(4)]
+
+    scores, maps = compare_ssim_batch(np.stack([X for X, _ in pairs]), np.stack([Y for _, Y in pairs]),
+                                      gaussian_weights=gaussian_weights, full=True)
+
+    for k, (X, Y) in enumerate(pairs):
+        mssim, S = compare_ssim(X, Y, full=True, gaussian_weights=gaussian_weights)
+        assert scores[k] == pytest.approx(mssim, abs=1e-12)
+        np.testing.assert_allclose(maps[k], S, atol=1e-12)
+
+
+def test_batch_size():
+    # per pixel: two 8-bit inputs, two float copies and six float buffers
+    assert ssim_batch_size((100, 100), memory=10 * 100 * 100 * 66) == 10
+    assert ssim_batch_size((100, 100), np.float32, memory=10 * 100 * 100 * 34) == 10
+    assert ssim_batch_size((3742, 2646)) == 1